@@ -22,8 +22,20 @@ import os
 import sys
 import subprocess
 import queue
+import multiprocessing
 import requests
 
+from metrics import REGISTRY as METRICS
+from diagnostics import StatusBoard, DiagnosticsServer, read_status
+from instance import InstanceLock, ControlServer, send_control
+from agent_logging import setup_logging, shutdown_logging
+from telemetry import TelemetryFrame, FRAME_INTERVAL, HEARTBEAT_QUIET
+from health import HealthSampler
+from backoff import Backoff
+from commands import CommandDispatcher, CommandError, tail_file, bounded
+from events import Event, wire_json
+import backfill
+
 # ---------------------------------------------------------
 # DEPENDENCIES CHECK
 # ---------------------------------------------------------
@@ -42,13 +54,18 @@ except ImportError:
 # Local Modules
 try:
     from version import VERSION
-    from updater import check_update_loop
+    from updater import check_update_loop, UpdateCoordinator
     from parsers.loader import load_parser
-    from parsers.SnmpParser import SnmpParser
 except ImportError as e:
     VERSION = "2.5.1"
+    UpdateCoordinator = None
+    def check_update_loop(*args): pass
+
+# Optional: Konica SNMP (needs pysnmp)
+try:
+    from parsers.SnmpParser import SnmpParser
+except ImportError:
     SnmpParser = None
-    def check_update_loop(): pass
 
 # Windows Registry
 try:
@@ -76,7 +93,18 @@ except Exception:
 # -----------------------
 DEFAULT_SERVER_URL = os.environ.get("SERVER_URL", "https://python.printhex.in")
 REGISTRY_KEY_NAME = "PrintHexAgent"
+OUTBOX_MAX_EVENTS = 5000   # Events waiting for the socket; beyond this new events are dropped
+ACTIVITY_EVENTS = {"JOB_INFO", "JOB_PROGRESS", "serial"}  # "Machine is working" → updater waits
+RECONNECT_BASE = 2      # seconds, doubled per failed attempt (with jitter)
+RECONNECT_CAP = 120     # never wait longer than this between attempts
+RECONNECT_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
 APP_CONFIG = {}
+_UPDATER_STARTED = False
+
+log = logging.getLogger("agent")
+
+# Updater ↔ monitors: activity defers installs, handover flushes + checkpoints
+UPDATE_COORDINATOR = UpdateCoordinator() if UpdateCoordinator else None
 
 # ==========================================
 # 1. SYSTEM UTILITIES (Startup, Reset, Config)
@@ -88,55 +116,91 @@ def get_config_path():
         os.makedirs(app_data)
     return os.path.join(app_data, 'config.json')
 
+def get_data_path(name):
+    """Any other agent file (lock, control, diagnostics) lives next to config.json."""
+    return os.path.join(os.path.dirname(get_config_path()), name)
+
+def get_diagnostics_path():
+    return get_data_path('diagnostics.json')
+
+def load_checkpoint():
+    """One-shot: returns the checkpoint written before an update and removes it."""
+    path = get_data_path('checkpoint.json')
+    try:
+        with open(path, 'r') as f: data = json.load(f)
+    except: return None
+    try: os.remove(path)
+    except OSError: pass
+    return data
+
+def save_checkpoint(data):
+    with open(get_data_path('checkpoint.json'), 'w') as f:
+        json.dump(data, f)
+
 def load_config():
     try:
         with open(get_config_path(), 'r') as f: return json.load(f)
     except: return None
 
+def get_launch_command(*args):
+    """Command line that re-launches this agent (exe or script) with the given flags."""
+    if getattr(sys, 'frozen', False):
+        # If running as compiled exe
+        return [sys.executable, *args]
+    # If running as python script
+    return [sys.executable, os.path.abspath(__file__), *args]
+
 def setup_startup():
-    """Adds the agent to Windows Startup Registry."""
+    """Adds the agent to Windows Startup Registry (only writes when the entry changed)."""
     if not winreg: return
     try:
-        exe = sys.executable
-        if getattr(sys, 'frozen', False):
-            # If running as compiled exe
-            cmd = f'"{exe}" --background'
-        else:
-            # If running as python script
-            cmd = f'"{exe}" "{os.path.abspath(__file__)}" --background'
-            
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r'Software\Microsoft\Windows\CurrentVersion\Run', 0, winreg.KEY_SET_VALUE)
-        winreg.SetValueEx(key, REGISTRY_KEY_NAME, 0, winreg.REG_SZ, cmd)
+        cmd = subprocess.list2cmdline(get_launch_command("--background"))
+        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r'Software\Microsoft\Windows\CurrentVersion\Run', 0,
+                             winreg.KEY_SET_VALUE | winreg.KEY_QUERY_VALUE)
+        try: current = winreg.QueryValueEx(key, REGISTRY_KEY_NAME)[0]
+        except OSError: current = None
+        if current != cmd:
+            winreg.SetValueEx(key, REGISTRY_KEY_NAME, 0, winreg.REG_SZ, cmd)
+            log.info("Startup Registry Updated.")
         winreg.CloseKey(key)
-        logging.info("Startup Registry Updated.")
     except Exception as e:
-        logging.error(f"Startup Error: {e}")
+        log.error(f"Startup Error: {e}")
+
+def start_background_agent():
+    """Makes sure one background agent is running; asks it to reload config if it already is."""
+    if send_control(get_data_path('agent.control.json'), "reload"):
+        return
+    subprocess.Popen(get_launch_command("--background"),
+                     creationflags=getattr(subprocess, 'DETACHED_PROCESS', 0))
 
 def full_reset_agent():
     """SECURITY: Deletes config and stops agent if server bans device."""
-    logging.warning("⛔ DEVICE UNAUTHORIZED! Resetting Agent...")
+    log.warning("⛔ DEVICE UNAUTHORIZED! Resetting Agent...")
     try:
         path = get_config_path()
         if os.path.exists(path):
             os.remove(path)
     except: pass
     
-    # Force kill the process
+    # Force kill the process (flush queued log lines first)
+    shutdown_logging()
     os._exit(0) 
 
 # ==========================================
 # 2. CLIENT DASHBOARD (Status Window)
 # ==========================================
-def show_status_gui(conf):
+def show_status_gui(conf, commands=None):
     """
     Shows this window when user clicks Desktop Shortcut.
-    It runs the agent in background thread, but shows UI to user.
+    The agent itself runs in the --background process; this window polls
+    its local diagnostics endpoint every few seconds and shows live state.
+    `commands` receives "show" when a later launch asks for the dashboard.
     """
     if not tk: return
     
     root = tk.Tk()
     root.title("PrintHex Agent Status")
-    root.geometry("450x420")
+    root.geometry("450x590")
     root.resizable(False, False)
     
     # Modern Dark Theme
@@ -145,14 +209,10 @@ def show_status_gui(conf):
     TEXT = "#f1f5f9"
     root.configure(bg=BG)
 
-    # # Start Agent Logic in Background
-    add_row("Agent Mode:", "Running in Background ✅")
-    # t = threading.Thread(target=run_agent_process, args=(conf,), daemon=True)
-    # t.start()
-
     # UI Header
     tk.Label(root, text="PRINTHEX IOT", bg=BG, fg="white", font=("Segoe UI", 18, "bold")).pack(pady=(30, 5))
-    tk.Label(root, text="System is Active", bg=BG, fg="#4ade80", font=("Segoe UI", 10)).pack(pady=(0, 20))
+    lbl_headline = tk.Label(root, text="Checking agent...", bg=BG, fg="#94a3b8", font=("Segoe UI", 10))
+    lbl_headline.pack(pady=(0, 20))
     
     # Info Card
     card = tk.Frame(root, bg=CARD, padx=20, pady=20)
@@ -162,18 +222,97 @@ def show_status_gui(conf):
         f = tk.Frame(card, bg=CARD)
         f.pack(fill="x", pady=5)
         tk.Label(f, text=label, bg=CARD, fg="#94a3b8", width=15, anchor="w", font=("Segoe UI", 10)).pack(side="left")
-        tk.Label(f, text=value, bg=CARD, fg="white", font=("Segoe UI", 10, "bold")).pack(side="right")
+        val = tk.Label(f, text=value, bg=CARD, fg="white", font=("Segoe UI", 10, "bold"))
+        val.pack(side="right")
+        return val
 
     add_row("Device ID:", conf.get('device_id', 'Unknown')[:18] + "...")
     add_row("Machine Type:", conf.get('machine_type', 'Flex').upper())
-    add_row("Connection:", "Online 🟢")
+    lbl_mode = add_row("Agent Mode:", "...")
+    lbl_conn = add_row("Connection:", "...")
+    lbl_device = add_row("Machine Link:", "-")
+    lbl_queue = add_row("Queued Events:", "-")
+    lbl_flow = add_row("Data Flow:", "-")
+    lbl_last = add_row("Last Event:", "-")
+
+    tk.Label(root, text="Recent errors", bg=BG, fg="#64748b", font=("Segoe UI", 9)).pack(anchor="w", padx=30, pady=(15, 0))
+    lst_errors = tk.Listbox(root, height=4, bg=CARD, fg="#fca5a5", relief="flat", font=("Consolas", 8))
+    lst_errors.pack(fill="x", padx=30)
+
+    def ago(ts):
+        if not ts: return "never"
+        secs = int(time.time() - ts)
+        return f"{secs}s ago" if secs < 120 else f"{secs // 60}m ago"
+
+    def machine_link(st):
+        """Why data may not be flowing: serial port / SNMP / log file state for this machine type."""
+        dev = st.get("device") or {}
+        mtype = (st.get("machine_type") or "").lower()
+        if mtype == "laser":
+            port = dev.get("serial_port") or "no port set"
+            return f"Serial {port} open 🟢" if dev.get("serial_open") else f"Serial {port} closed 🔴"
+        if mtype == "konica":
+            status = dev.get("snmp_status")
+            if not status: return "SNMP not polled yet"
+            return f"SNMP {status} ({ago(dev.get('snmp_polled_at'))})" + (" 🔴" if status == "OFFLINE" else " 🟢")
+        return "Log file found 🟢" if dev.get("log_found") else "Log file missing 🔴"
+
+    # --- Live polling (HTTP runs off the Tk thread) ---
+    polled = queue.Queue()
+
+    def poll():
+        polled.put(read_status(get_diagnostics_path()))
+
+    def bring_to_front():
+        while commands is not None and not commands.empty():
+            commands.get_nowait()
+            root.deiconify(); root.lift(); root.focus_force()
+            root.attributes("-topmost", True)
+            root.after(500, lambda: root.attributes("-topmost", False))
+        root.after(300, bring_to_front)
+
+    bring_to_front()
+
+    def refresh():
+        try: st = polled.get_nowait()
+        except queue.Empty:
+            root.after(200, refresh)
+            return
+        if st is None:
+            lbl_headline.config(text="Agent is not running", fg="#f87171")
+            lbl_mode.config(text="Stopped 🔴")
+            lbl_conn.config(text="Unknown")
+            for lbl in (lbl_device, lbl_queue, lbl_flow, lbl_last): lbl.config(text="-")
+        else:
+            state = st["connection"]["state"]
+            online = state == "online"
+            lbl_headline.config(text="System is Active" if online else f"Agent running, {state}",
+                                fg="#4ade80" if online else "#facc15")
+            lbl_mode.config(text="Running in Background ✅")
+            lbl_conn.config(text=f"Online 🟢 ({ago(st['connection']['since'])})" if online else f"{state.title()} 🟡")
+            lbl_device.config(text=machine_link(st))
+            lbl_queue.config(text=", ".join(f"{k}: {v}" for k, v in st.get("queues", {}).items()) or "-")
+            mons = st.get("monitors", {})
+            lbl_flow.config(text=", ".join(f"{k} {m['events_per_min']:.0f}/min" for k, m in mons.items()) or "No data yet")
+            last = max([m["last_event"] or 0 for m in mons.values()] or [0])
+            lbl_last.config(text=ago(last))
+            lst_errors.delete(0, tk.END)
+            for err in reversed(st.get("recent_errors", [])):
+                lst_errors.insert(tk.END, f"{time.strftime('%H:%M:%S', time.localtime(err['ts']))} {err['message']}")
+        root.after(3000, lambda: threading.Thread(target=poll, daemon=True).start())
+        root.after(3000, refresh)
+
+    threading.Thread(target=poll, daemon=True).start()
+    root.after(200, refresh)
     
     # Buttons
     def on_reset():
         if messagebox.askyesno("Reset", "Are you sure? This will disconnect the device and delete settings."):
+            # Stop the --background agent too, or it keeps streaming with the removed credentials
+            send_control(get_data_path('agent.control.json'), "stop")
             full_reset_agent()
 
-    tk.Label(root, text="This application runs silently in the background.", bg=BG, fg="#64748b", font=("Segoe UI", 9)).pack(pady=(30, 10))
+    tk.Label(root, text="This application runs silently in the background.", bg=BG, fg="#64748b", font=("Segoe UI", 9)).pack(pady=(15, 10))
     
     btn_frame = tk.Frame(root, bg=BG)
     btn_frame.pack(fill="x", padx=30)
@@ -292,8 +431,8 @@ def create_config_gui(default_server=DEFAULT_SERVER_URL):
                 "Configuration Saved!\nAgent will now run in background."
             )
 
-            # ✅ Start background agent immediately
-            subprocess.Popen([sys.executable, "--background"], creationflags=subprocess.DETACHED_PROCESS)
+            # ✅ Start background agent immediately (or reload the running one)
+            start_background_agent()
 
             root.destroy()
 
@@ -368,17 +507,20 @@ def create_config_gui(default_server=DEFAULT_SERVER_URL):
 # ==========================================
 # 4. AGENT LOGIC (All Features Preserved)
 # ==========================================
-def run_agent_process(conf):
+def run_agent_process(conf, stop_event=None):
+    """Runs all monitors until stop_event is set (control channel stop/reload)."""
+    global _UPDATER_STARTED
     log_folder = os.path.dirname(get_config_path())
     log_path = os.path.join(log_folder, 'agent.log')
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s',
-                        handlers=[logging.FileHandler(log_path, mode='a'), logging.StreamHandler(sys.stdout)])
+    setup_logging(log_path, conf.get("log_levels"))
 
-    logging.info(">>> Agent Starting Up...")
+    log.info(">>> Agent Starting Up...")
 
-    # Start Updater
-    try: threading.Thread(target=check_update_loop, daemon=True).start()
-    except: pass
+    # Start Updater (once per process, survives config reloads)
+    if not _UPDATER_STARTED:
+        _UPDATER_STARTED = True
+        try: threading.Thread(target=check_update_loop, args=(UPDATE_COORDINATOR,), daemon=True).start()
+        except: pass
 
     SERVER = conf.get("server_url")
     DEV_ID = conf.get("device_id")
@@ -388,168 +530,555 @@ def run_agent_process(conf):
     SERIAL = conf.get("serial_port")
     BAUD = int(conf.get("baudrate") or 9600)
     IP_ADDR = conf.get("ip_address")
+    SNMP_PORT = int(conf.get("snmp_port") or 161)
 
     PARSER = load_parser(TYPE)
-    sio = Client(reconnection=True, reconnection_delay=5)
+    flex_log = logging.getLogger("agent.flex")
+    serial_log = logging.getLogger("agent.serial")
+    snmp_log = logging.getLogger("agent.snmp")
+    sio = Client(reconnection=False, json=wire_json)   # Reconnects are driven below with jittered backoff
+    backoff = Backoff(RECONNECT_BASE, RECONNECT_CAP)
+    session = {"token": None, "resuming": False, "retry_now": False, "down_since": time.perf_counter()}
     auth_event = threading.Event()
-    stop_event = threading.Event()
+    stop_event = stop_event or threading.Event()
+    outbox = queue.Queue(maxsize=OUTBOX_MAX_EVENTS)
+    board = StatusBoard()
+    log_state = {"pos": None}   # Flex tail position, checkpointed before an update
+    rates = {"snmp": 5.0, "telemetry": float(FRAME_INTERVAL)}   # seconds, changeable by command
+    snmp_state = {"parser": None, "lock": threading.Lock(), "status": None, "polled_at": None}
+    serial_wake = threading.Event()
+    error_capture = board.error_handler()
+    logging.getLogger().addHandler(error_capture)
     _serial_open = False
 
+    # --- Metrics (grab objects once, hot path only calls inc/observe) ---
+    M = METRICS
+    m_emitted = M.counter("events.emitted")
+    m_drop_full = M.counter("events.dropped.queue_full")
+    m_drop_error = M.counter("events.dropped.emit_error")
+    g_queue = M.gauge("queue.outbox.depth")
+    h_emit = M.histogram("emit.latency_seconds")
+    m_lines = M.counter("flex.lines_read")
+    h_parse = M.histogram("flex.parse_seconds")
+    m_serial_bytes = M.counter("serial.bytes")
+    m_serial_lines = M.counter("serial.lines")
+    h_snmp = M.histogram("snmp.rtt_seconds")
+    m_connects = M.counter("socket.connects")
+    m_reconnects = M.counter("socket.reconnects")
+    m_disconnects = M.counter("socket.disconnects")
+    m_resumes = M.counter("socket.resumes")
+    m_resume_rejected = M.counter("socket.resume_rejected")
+    h_reconnect = M.histogram("socket.reconnect_seconds", RECONNECT_BUCKETS)
+
+    def count_error(stage, e):
+        M.counter(f"errors.{stage}").inc()
+        board.record_error(stage, e)   # Dashboard "recent errors" without flooding agent.log
+        logging.getLogger(f"agent.{stage}").debug(f"{stage} error: {e}")
+
     # --- Helper: Send Event ---
-    def send_event(evt_type, payload={}):
-        if sio.connected and auth_event.is_set():
-            sio.emit("device_event", {
-                "type": evt_type, "device_id": DEV_ID, 
-                "payload": payload, "created_at": int(time.time()*1000)
-            }, namespace='/agent')
-
-    # --- Heartbeat (Fast) ---
-    def heartbeat_loop():
-        while not stop_event.is_set():
-            if auth_event.wait(timeout=1) and sio.connected:
-                try: sio.emit("heartbeat", {"device_id": DEV_ID, "ts": int(time.time()*1000)}, namespace='/agent')
-                except: pass
-            stop_event.wait(10)
+    # Producers only enqueue; sender_loop owns the socket so a slow
+    # network never stalls the log tail or serial threads. Events keep
+    # queuing while offline and flush as soon as the session is back.
+    # Accepts a parser Event as-is, or (type, payload) for agent-built events.
+    def send_event(evt, payload=None):
+        if not isinstance(evt, Event): evt = Event(evt, payload)
+        if evt.type in ACTIVITY_EVENTS and UPDATE_COORDINATOR: UPDATE_COORDINATOR.activity()
+        evt.queued_at = time.perf_counter()
+        try:
+            outbox.put_nowait(evt)
+        except queue.Full:
+            m_drop_full.inc()
 
-    # --- Status Loop ---
-    def status_loop():
+    def sender_loop():
+        item, failures = None, 0
         while not stop_event.is_set():
-            if auth_event.wait(timeout=1):
-                send_event("device_status", {
-                    "serial_connected": bool(_serial_open),
-                    "log_monitored": bool(LOG_PATH and os.path.exists(LOG_PATH)),
-                    "ip_configured": bool(IP_ADDR),
-                    "mode": TYPE
-                })
-            stop_event.wait(60)
+            if not (auth_event.wait(timeout=1) and sio.connected): continue
+            if item is None:
+                try: item = outbox.get(timeout=1)
+                except queue.Empty: continue
+                failures = 0
+            g_queue.set(outbox.qsize())
+            try:
+                item.encode(DEV_ID)   # Once; a retried event reuses the same text
+                sio.emit("device_event", item, namespace='/agent')
+                m_emitted.inc()
+                h_emit.observe(time.perf_counter() - item.queued_at)
+                board.last_emit = time.time()
+                item = None
+                outbox.task_done()
+            except Exception as e:
+                # Keep the event for the next session; give up on one that keeps failing
+                failures += 1
+                count_error("emit", e)
+                if failures >= 3:
+                    m_drop_error.inc()
+                    item = None
+                    outbox.task_done()
+                stop_event.wait(0.5)
+
+    # --- Telemetry (status + health + metrics in one frame) ---
+    # Any data emit already proves liveness, so an explicit heartbeat
+    # is only sent after HEARTBEAT_QUIET seconds with nothing on the wire.
+    frame = TelemetryFrame(M)
+    m_heartbeats = M.counter("telemetry.heartbeats")
+
+    def device_status():
+        return {
+            "serial_connected": bool(_serial_open),
+            "log_monitored": bool(LOG_PATH and os.path.exists(LOG_PATH)),
+            "ip_configured": bool(IP_ADDR),
+            "mode": TYPE
+        }
+
+    # RIP spool drive = configured spool folder, else the Flex log's folder
+    sampler = HealthSampler(conf.get("spool_path") or (os.path.dirname(LOG_PATH) if LOG_PATH else None),
+                            float(conf.get("health_sample_interval") or 5))
+
+    def system_health():
+        try: return sampler.report(rates["telemetry"])
+        except Exception as e:
+            count_error("health", e)
+            return None
+
+    def health_loop():
+        sampler.run(stop_event)
+
+    def telemetry_loop():
+        last_frame = last_heartbeat = 0.0
+        was_ready = False
+        while not stop_event.wait(1):
+            ready = sio.connected and auth_event.is_set()
+            if not ready:
+                was_ready = False
+                continue
+            now = time.time()
+            status = device_status()
+            if not was_ready or now - last_frame >= rates["telemetry"] or frame.status_changed(status):
+                g_queue.set(outbox.qsize())
+                send_event("TELEMETRY", frame.build(status, system_health()))
+                last_frame = now
+            elif now - max(board.last_emit or 0, last_heartbeat) >= HEARTBEAT_QUIET:
+                try:
+                    sio.emit("heartbeat", {"device_id": DEV_ID, "ts": int(now*1000)}, namespace='/agent')
+                    m_heartbeats.inc()
+                except Exception as e: count_error("heartbeat", e)
+                last_heartbeat = now
+            was_ready = True
 
     # --- 1. LASER MONITOR ---
     def start_serial():
         nonlocal _serial_open
         if not SERIAL or not serial: return
-        logging.info(f"Starting Serial: {SERIAL}")
+        serial_log.info(f"Starting Serial: {SERIAL}")
         while not stop_event.is_set():
             try:
                 with serial.Serial(SERIAL, BAUD, timeout=1) as ser:
                     _serial_open = True
                     while not stop_event.is_set():
-                        line = ser.readline().decode('utf-8', errors='ignore').strip()
-                        if line: send_event("serial", {"raw": line})
-            except:
+                        raw = ser.readline()
+                        if not raw: continue
+                        m_serial_bytes.inc(len(raw))
+                        line = raw.decode('utf-8', errors='ignore').strip()
+                        if line:
+                            m_serial_lines.inc()
+                            board.touch("serial")
+                            send_event("serial", {"raw": line})
+            except Exception as e:
+                count_error("serial", e)
                 _serial_open = False
-                time.sleep(5)
+                serial_wake.wait(5)   # serial_rescan command retries immediately
+                serial_wake.clear()
 
     # --- 2. FLEX MONITOR (Robust Size-Based) ---
     def start_log_monitor():
         if not LOG_PATH or not os.path.exists(LOG_PATH):
-            logging.error(f"Log file not found: {LOG_PATH}")
+            flex_log.error(f"Log file not found: {LOG_PATH}")
             return
         
-        logging.info(f"Starting Log Monitor: {LOG_PATH}")
+        flex_log.info(f"Starting Log Monitor: {LOG_PATH}")
         last_pos = 0
         try: last_pos = os.path.getsize(LOG_PATH)
         except: pass
 
+        # After an update: replay what was written while the installer ran
+        ckpt = load_checkpoint()
+        if ckpt and ckpt.get("log_file_path") == LOG_PATH and 0 <= ckpt.get("pos", -1) <= last_pos:
+            flex_log.info(f"Resuming from checkpoint at byte {ckpt['pos']}")
+            last_pos = ckpt["pos"]
+        log_state["pos"] = last_pos
+
         while not stop_event.is_set():
             time.sleep(1) # Check every 1s
             if not os.path.exists(LOG_PATH): continue
 
             try:
                 curr = os.path.getsize(LOG_PATH)
-                if curr < last_pos: last_pos = 0 # File reset
+                if curr < last_pos: last_pos = log_state["pos"] = 0 # File reset
                 
                 if curr > last_pos:
                     with open(LOG_PATH, 'r', encoding='utf-8', errors='ignore') as f:
                         f.seek(last_pos)
                         data = f.read()
                         last_pos = f.tell()
-                        
+
                         if data:
                             for line in data.splitlines():
                                 line = line.strip()
                                 if line:
+                                    m_lines.inc()
+                                    board.touch("flex")
                                     send_event("LOG_RAW", {"line": line})
                                     # Parse if needed
                                     if PARSER:
+                                        t0 = time.perf_counter()
                                         res = PARSER.parse(line)
+                                        h_parse.observe(time.perf_counter() - t0)
                                         if res:
                                             if isinstance(res, list):
-                                                for r in res: send_event(r.get('event'), r.get('payload'))
+                                                for r in res: send_event(r)
                                             else:
-                                                send_event(res['event'], res['payload'])
+                                                send_event(res)
+                        # Published only after every line up to here is queued (handover checkpoint)
+                        log_state["pos"] = last_pos
             except Exception as e:
-                logging.error(f"Log Read Error: {e}")
+                M.counter("errors.flex").inc()
+                flex_log.error(f"Log Read Error: {e}")
 
     # --- 3. KONICA MONITOR (SNMP) ---
+    def snmp_poll_once():
+        """One poll; shared by the monitor loop and the snmp_poll command."""
+        with snmp_state["lock"]:
+            if snmp_state["parser"] is None: snmp_state["parser"] = SnmpParser(IP_ADDR, port=SNMP_PORT)
+            t0 = time.perf_counter()
+            events = snmp_state["parser"].parse()
+            h_snmp.observe(time.perf_counter() - t0)
+        board.touch("snmp")
+        status = events[0].payload.get("status") if events else None
+        snmp_state["status"], snmp_state["polled_at"] = status, time.time()
+        if status == "OFFLINE": board.record_error("snmp", f"no SNMP answer from {IP_ADDR}:{SNMP_PORT}", "WARNING")
+        for ev in events or []: send_event(ev)
+        return events or []
+
     def start_snmp_monitor():
         if not SnmpParser or not IP_ADDR: return
-        logging.info(f"Starting SNMP: {IP_ADDR}")
-        parser = SnmpParser(IP_ADDR)
+        snmp_log.info(f"Starting SNMP: {IP_ADDR}")
         while not stop_event.is_set():
-            try:
-                events = parser.parse()
-                if events:
-                    for ev in events: send_event(ev['event'], ev['payload'])
-            except: pass
-            time.sleep(5)
-
-    # --- 4. SYSTEM HEALTH (New) ---
-    def monitor_health():
-        if not psutil: return
-        while not stop_event.is_set():
-            time.sleep(60)
-            try:
-                send_event("SYSTEM_HEALTH", {
-                    "cpu": psutil.cpu_percent(),
-                    "ram": psutil.virtual_memory().percent
-                })
-            except: pass
+            try: snmp_poll_once()
+            except Exception as e: count_error("snmp", e)
+            stop_event.wait(rates["snmp"])
+
+    # --- 4. SERVER COMMANDS ---
+    def reply_command(command_id, result):
+        send_event("command_result", {"command_id": command_id, "result": result,
+                                      "timestamp": int(time.time()*1000)})
+
+    commands = CommandDispatcher(reply_command)
+
+    def cmd_snmp_poll(payload):
+        if not SnmpParser or not IP_ADDR: raise CommandError("SNMP is not configured on this agent")
+        events = snmp_poll_once()
+        return {"events": [ev.type for ev in events]}
+
+    def cmd_serial_rescan(payload):
+        ports = [p.device for p in list_ports.comports()] if list_ports else []
+        if SERIAL and not _serial_open: serial_wake.set()
+        return {"ports": ports, "configured": SERIAL, "open": bool(_serial_open)}
+
+    def cmd_log_tail(payload):
+        n = int(bounded(payload, "lines", 1, 500) or 50)
+        return {"lines": tail_file(log_path, n)}
+
+    def cmd_set_sampling_rate(payload):
+        snmp = bounded(payload, "snmp_interval", 1, 3600)
+        health = bounded(payload, "health_interval", 1, 300)
+        tel = bounded(payload, "telemetry_interval", 10, 3600)
+        if snmp is not None: rates["snmp"] = snmp
+        if health is not None: sampler.interval = health
+        if tel is not None: rates["telemetry"] = tel
+        return {"snmp_interval": rates["snmp"], "health_interval": sampler.interval,
+                "telemetry_interval": rates["telemetry"]}
+
+    commands.register("echo_ping", lambda p: {"echo": p.get("message")})
+    commands.register("get_state", lambda p: {"status": device_status(), "connection": board.snapshot()["connection"],
+                                              "queue": outbox.qsize(), "version": VERSION})
+    commands.register("snmp_poll", cmd_snmp_poll)
+    commands.register("serial_rescan", cmd_serial_rescan)
+    commands.register("metrics_snapshot", lambda p: {"metrics": M.snapshot()})
+    commands.register("log_tail", cmd_log_tail)
+    commands.register("set_sampling_rate", cmd_set_sampling_rate)
 
     # --- Socket Events ---
+    def session_ready():
+        auth_event.set()
+        board.set_connection("online")
+        backoff.reset()
+        h_reconnect.observe(time.perf_counter() - session["down_since"])
+
     @sio.event(namespace='/agent')
     def connect():
-        logging.info("Socket Connected.")
+        if m_connects.value: m_reconnects.inc()
+        m_connects.inc()
+        if session["resuming"]:
+            # Server accepted the session token in the CONNECT packet: no auth round-trip
+            log.info("Socket Connected, session resumed.")
+            m_resumes.inc()
+            session_ready()
+            return
+        log.info("Socket Connected.")
+        board.set_connection("authenticating")
         sio.emit("auth", {"device_id": DEV_ID, "jwt": TOKEN}, namespace='/agent')
 
     @sio.on('auth_result', namespace='/agent')
     def on_auth(data):
         if data.get('status') == 'success':
-            auth_event.set()
+            session["token"] = data.get('session_token')
+            if not auth_event.is_set(): session_ready()
             sio.emit("machine_state", {"device_id": DEV_ID, "running": True, "reason": "startup"}, namespace='/agent')
+        elif session["resuming"]:
+            # Stale session, not a banned device: fall back to full auth
+            log.warning("Session resume refused, re-authenticating.")
+            session["token"] = None
+            session["resuming"] = False
+            auth_event.clear()
+            m_resume_rejected.inc()
+            sio.emit("auth", {"device_id": DEV_ID, "jwt": TOKEN}, namespace='/agent')
         else:
-            logging.error("⛔ AUTH FAILED: Device Banned/Invalid.")
+            log.error("⛔ AUTH FAILED: Device Banned/Invalid.")
+            board.set_connection("auth failed")
             sio.disconnect()
             full_reset_agent() # KILL SWITCH
 
+    @sio.on('command', namespace='/agent')
+    def on_command(data):
+        commands.dispatch(data)
+
     @sio.on('disconnect', namespace='/agent')
     def on_disconnect():
+        m_disconnects.inc()
         auth_event.clear()
+        session["down_since"] = time.perf_counter()
+        board.set_connection("offline")
 
-    # --- START THREADS ---
-    threading.Thread(target=heartbeat_loop, daemon=True).start()
-    threading.Thread(target=status_loop, daemon=True).start()
-    threading.Thread(target=monitor_health, daemon=True).start()
-
-    if TYPE == "konica": threading.Thread(target=start_snmp_monitor, daemon=True).start()
-    elif TYPE == "flex": threading.Thread(target=start_log_monitor, daemon=True).start()
-    elif TYPE == "laser" and SERIAL: threading.Thread(target=start_serial, daemon=True).start()
+    def connect_socket():
+        session["resuming"] = bool(session["token"])
+        auth = {"device_id": DEV_ID, "session_token": session["token"]} if session["resuming"] else None
+        try:
+            sio.connect(SERVER, namespaces=["/agent"], auth=auth)
+        except Exception:
+            if session["resuming"] and '/agent' in (sio.failed_namespaces or []):
+                # Namespace rejected the token (server reachable): retry now with full auth
+                session["token"] = None
+                session["retry_now"] = True
+                m_resume_rejected.inc()
+            raise
+
+    # --- Local Diagnostics (read by the dashboard) ---
+    def diag_snapshot():
+        st = board.snapshot()
+        st.update({
+            "version": VERSION, "pid": os.getpid(), "device_id": DEV_ID, "machine_type": TYPE,
+            "queues": {"outbox": outbox.qsize()},
+            "serial_open": bool(_serial_open),
+            "device": {"serial_port": SERIAL, "serial_open": bool(_serial_open),
+                       "log_found": bool(LOG_PATH and os.path.exists(LOG_PATH)),
+                       "snmp_status": snmp_state["status"], "snmp_polled_at": snmp_state["polled_at"]},
+            "health": system_health(),
+            "metrics": M.snapshot()["counters"],
+        })
+        return st
+
+    diag = None
+    try: diag = DiagnosticsServer(diag_snapshot, get_diagnostics_path(), conf.get("diagnostics_port") or 0).start()
+    except Exception as e: log.error(f"Diagnostics endpoint failed: {e}")
+
+    # --- Update handover: flush queued events + checkpoint before installer ---
+    handover_state = {"announced": False}   # machine_state running=false already sent
+
+    def on_update_handover(timeout):
+        """Returns False (update postponed) unless every queued event was delivered."""
+        log.info("🔄 Update handover: flushing events...")
+        deadline = time.time() + timeout
+        while True:
+            # pos first: every line before it is already queued, so an empty
+            # queue afterwards means everything up to pos reached the server
+            pos = log_state["pos"]
+            if not outbox.unfinished_tasks: break
+            if time.time() >= deadline:
+                log.warning(f"Update postponed: {outbox.unfinished_tasks} events not delivered")
+                return False
+            time.sleep(0.1)
+        if sio.connected:
+            try:
+                sio.emit("machine_state", {"device_id": DEV_ID, "running": False, "reason": "update"}, namespace='/agent')
+                handover_state["announced"] = True
+            except Exception as e: count_error("emit", e)
+        if LOG_PATH and pos is not None:
+            save_checkpoint({"log_file_path": LOG_PATH, "pos": pos, "ts": time.time()})
+        log.info("Handover done, all events delivered")
+        return True
+
+    def on_update_abort():
+        # Installer did not start: drop the checkpoint (it would rewind the tail on next start)
+        try: os.remove(get_data_path('checkpoint.json'))
+        except OSError: pass
+        if handover_state["announced"] and sio.connected:
+            try: sio.emit("machine_state", {"device_id": DEV_ID, "running": True, "reason": "update_failed"}, namespace='/agent')
+            except Exception as e: count_error("emit", e)
+        handover_state["announced"] = False
+        log.warning("Update aborted, agent keeps running")
+
+    unregister_handover = (UPDATE_COORDINATOR.register(on_update_handover, on_update_abort)
+                           if UPDATE_COORDINATOR else None)
+
+    # --- Stop watcher: a stop/reload request breaks sio.wait() below ---
+    def stop_watcher():
+        stop_event.wait()
+        try: sio.disconnect()
+        except Exception: pass
 
-    logging.info("Agent Running...")
+    # --- START THREADS ---
+    workers = [sender_loop, telemetry_loop, health_loop, stop_watcher]
+    if TYPE == "konica": workers.append(start_snmp_monitor)
+    elif TYPE == "flex": workers.append(start_log_monitor)
+    elif TYPE == "laser" and SERIAL: workers.append(start_serial)
+    threads = [threading.Thread(target=w, name=f"agent-{w.__name__}", daemon=True) for w in workers]
+    for t in threads: t.start()
+
+    log.info("Agent Running...")
     
     while not stop_event.is_set():
         try:
-            if not sio.connected: sio.connect(SERVER, namespaces=["/agent"])
+            if not sio.connected:
+                board.set_connection("connecting")
+                connect_socket()
             sio.wait()
-        except: time.sleep(5)
+        except Exception as e:
+            board.set_connection("offline")
+            log.warning(f"Connection failed: {e}")
+        if stop_event.is_set(): break
+        if session["retry_now"]:
+            session["retry_now"] = False
+            continue
+        delay = backoff.next()
+        log.info(f"Reconnecting in {delay:.1f}s")
+        stop_event.wait(delay)
+
+    # --- Shutdown (stop / reload) ---
+    log.info("Agent stopping...")
+    # Wait for every monitor to exit (an SNMP poll can take ~20 s to time out),
+    # so a reload never runs two pollers/tails side by side
+    serial_wake.set()
+    waited = 0
+    for t in threads:
+        while t.is_alive():
+            t.join(timeout=5)
+            waited += 5
+            if t.is_alive() and waited % 30 == 0: log.warning(f"Still waiting for {t.name} to stop...")
+    if unregister_handover: unregister_handover()
+    commands.shutdown()
+    if diag: diag.stop()
+    logging.getLogger().removeHandler(error_capture)
+
+# ==========================================
+# 5. SINGLE INSTANCE (Lock + Control Channel)
+# ==========================================
+def run_background(cfg):
+    """Runs the agent unless another background agent already holds the lock."""
+    lock = InstanceLock(get_data_path('agent.lock'))
+    if not lock.acquire():
+        # Already running: nothing to do, and nothing written to agent.log
+        send_control(get_data_path('agent.control.json'), "ping")
+        return
+
+    state = {"action": None, "stop": None}   # stop: the Event of the run in progress
+
+    def on_command(command, args):
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid(), "version": VERSION}
+        if command in ("reload", "stop"):
+            state["action"] = command
+            if state["stop"]: state["stop"].set()
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown command: {command}"}
+
+    control = ControlServer(get_data_path('agent.control.json'), on_command).start()
+    try:
+        while cfg:
+            # A fresh Event per run: one from a previous run is never cleared under a live thread
+            state["action"], state["stop"] = None, threading.Event()
+            run_agent_process(cfg, state["stop"])
+            if state["action"] != "reload": break
+            cfg = load_config()
+    finally:
+        control.stop()
+        lock.release()
+        shutdown_logging()
+
+def open_dashboard(cfg):
+    """One dashboard window at a time; a second click just brings it to front."""
+    lock = InstanceLock(get_data_path('dashboard.lock'))
+    if not lock.acquire():
+        send_control(get_data_path('dashboard.control.json'), "show")
+        return
+
+    commands = queue.Queue()
+
+    def on_command(command, args):
+        if command == "show":
+            commands.put(command)
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown command: {command}"}
+
+    control = ControlServer(get_data_path('dashboard.control.json'), on_command).start()
+    try:
+        # Agent not answering? start it (a duplicate would exit on the lock anyway)
+        if not send_control(get_data_path('agent.control.json'), "ping"):
+            subprocess.Popen(get_launch_command("--background"),
+                             creationflags=getattr(subprocess, 'DETACHED_PROCESS', 0))
+        show_status_gui(cfg, commands)
+    finally:
+        control.stop()
+        lock.release()
 
 # ==========================================
-# 5. BOOTSTRAP (Entry Point)
+# 6. BOOTSTRAP (Entry Point)
 # ==========================================
 if __name__ == "__main__":
+    multiprocessing.freeze_support()   # Backfill workers re-enter the frozen exe
 
     cfg = load_config()
 
-    # ✅ Always ensure startup entry exists
+    # -----------------------------
+    # CONTROL: forward to the running agent
+    # -----------------------------
+    for flag in ("--stop", "--reload"):
+        if flag in sys.argv:
+            reply = send_control(get_data_path('agent.control.json'), flag[2:])
+            print(reply or "Agent is not running.")
+            sys.exit()
+
+    # -----------------------------
+    # BACKFILL: one-off upload of historical logs (runs beside the live agent)
+    # -----------------------------
+    if "--backfill" in sys.argv:
+        if not cfg:
+            print("Agent is not configured.")
+            sys.exit(1)
+        try:
+            files, since, processes = backfill.parse_args(sys.argv)
+        except ValueError as e:
+            print(f"{e}\n{backfill.USAGE}")
+            sys.exit(2)
+        setup_logging(get_data_path('backfill.log'), cfg.get("log_levels"))
+        try:
+            backfill.run_backfill(cfg, files or backfill.find_log_files(cfg, since),
+                                  get_data_path('backfill_state.json'), processes)
+        except Exception as e:
+            log.error(f"❌ Backfill stopped: {e} (run again to resume)")
+        shutdown_logging()
+        sys.exit()
+
+    # ✅ Ensure startup entry exists (no-op when already correct)
     setup_startup()
 
     # -----------------------------
@@ -557,7 +1086,7 @@ if __name__ == "__main__":
     # -----------------------------
     if "--background" in sys.argv:
         if cfg:
-            run_agent_process(cfg)
+            run_background(cfg)
         sys.exit()
 
     # -----------------------------
@@ -565,7 +1094,7 @@ if __name__ == "__main__":
     # -----------------------------
     if "--dashboard" in sys.argv:
         if cfg:
-            show_status_gui(cfg)
+            open_dashboard(cfg)
         else:
             create_config_gui(DEFAULT_SERVER_URL)
         sys.exit()
@@ -579,4 +1108,4 @@ if __name__ == "__main__":
 
     else:
         # Config already exists → just open dashboard
-        show_status_gui(cfg)
+        open_dashboard(cfg)
@@ -0,0 +1,112 @@
+# agent_logging.py
+"""
+Non-blocking, rotating, de-duplicating logging for the agent.
+- Callers only put records on a bounded queue (QueueHandler); a single
+  background QueueListener does the disk writes, so the tail/serial
+  threads never wait on the file system. If the queue is full the record
+  is dropped and counted instead of blocking.
+- agent.log rotates by size (RotatingFileHandler) with a fixed number of
+  backups, so it can no longer grow without bound on shop PCs.
+- Identical consecutive messages are collapsed into
+  "last message repeated N times".
+- Per-module levels come from config: {"log_levels": {"agent.flex": "DEBUG"}}.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from metrics import REGISTRY
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+MAX_BYTES = 1024 * 1024      # 1 MB per file
+BACKUP_COUNT = 3             # agent.log + agent.log.1..3
+QUEUE_SIZE = 10000
+REPEAT_FLUSH_SECONDS = 300   # Summarise a long run of repeats at least this often
+
+_listener = None
+
+
+class _DropQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = REGISTRY.counter("log.dropped")
+
+    def enqueue(self, record):
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped.inc()
+
+
+class _DedupHandler(logging.Handler):
+    """Wraps the real handlers; runs only on the listener thread."""
+
+    def __init__(self, targets):
+        super().__init__()
+        self.targets = targets
+        self.last_key = None
+        self.last_record = None
+        self.repeats = 0
+        self.first_repeat_at = 0
+
+    def _write(self, record):
+        for h in self.targets:
+            if record.levelno >= h.level: h.handle(record)
+
+    def _flush_repeats(self):
+        if self.repeats:
+            r = self.last_record
+            summary = logging.LogRecord(r.name, r.levelno, r.pathname, r.lineno,
+                                        f"last message repeated {self.repeats} times", None, None)
+            self._write(summary)
+            self.repeats = 0
+
+    def emit(self, record):
+        key = (record.name, record.levelno, record.getMessage())
+        if key == self.last_key:
+            if not self.repeats: self.first_repeat_at = time.time()
+            self.repeats += 1
+            self.last_record = record
+            if time.time() - self.first_repeat_at >= REPEAT_FLUSH_SECONDS: self._flush_repeats()
+            return
+        self._flush_repeats()
+        self.last_key, self.last_record = key, record
+        self._write(record)
+
+    def close(self):
+        self._flush_repeats()
+        for h in self.targets: h.close()
+        super().close()
+
+
+def setup_logging(log_path, levels=None, level=logging.INFO, console=True):
+    """Installs the queue-based logging once per process; later calls only re-apply levels."""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is None:
+        fmt = logging.Formatter(LOG_FORMAT)
+        targets = [logging.handlers.RotatingFileHandler(log_path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+                                                        encoding='utf-8', delay=True)]
+        if console and sys.stdout: targets.append(logging.StreamHandler(sys.stdout))
+        for h in targets: h.setFormatter(fmt)
+
+        q = queue.Queue(maxsize=QUEUE_SIZE)
+        for h in list(root.handlers): root.removeHandler(h)
+        root.addHandler(_DropQueueHandler(q))
+        _listener = logging.handlers.QueueListener(q, _DedupHandler(targets))
+        _listener.start()
+
+    for name, lvl in (levels or {}).items():
+        try: logging.getLogger(name).setLevel(str(lvl).upper())
+        except ValueError: logging.warning(f"Ignoring invalid log level {lvl!r} for {name}")
+    return _listener
+
+
+def shutdown_logging():
+    """Flushes queued records to disk (call before exiting the process)."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        for h in _listener.handlers: h.close()
+        _listener = None
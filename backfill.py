@@ -0,0 +1,324 @@
+# backfill.py
+"""
+Historical log backfill (python agent.py --backfill [files...] [--since YYYY-MM-DD]).
+---------------------------------------------------------
+1. Finds old Flex logs (default: every *.log* next to the configured log file,
+   except the live file itself, which the running agent already follows).
+2. Splits each file into byte ranges and parses them in parallel on all
+   but one CPU core with the normal machine parser (low process priority).
+3. Rebuilds job sessions (start → progress → finish) per file, in order.
+   Lines only carry the time of day ("9:45:37 AM : ..."); the date comes from
+   the file name (first line) or its mtime (last line), counting midnights.
+4. Uploads sessions in large gzip-compressed JSON batches over HTTP.
+Progress is kept in backfill_state.json, so an interrupted run continues
+where it stopped, and uploads are paced so live monitoring is not disturbed.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+import requests
+
+from backoff import Backoff
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+CHUNK_BYTES = 8 * 1024 * 1024     # Parse unit per worker
+BATCH_SESSIONS = 1000             # Sessions per upload
+UPLOAD_PAUSE = 2.0                # Seconds between uploads (throttle)
+UPLOAD_RETRIES = 6
+UPLOAD_PATH = "/api/agent/backfill"
+
+log = logging.getLogger("backfill")
+
+# Flex RIP line prefix: "9:45:37 AM : ..." (24h "13:05:22 : ..." also accepted)
+TOD_RE = re.compile(r"^(\d{1,2}):(\d{2}):(\d{2})\s*([AaPp][Mm])?\s*:")
+# Date in a log file name: 2025-09-18, 2025_09_18 or 20250918
+NAME_DATE_RE = re.compile(r"(20\d{2})[-_]?(\d{2})[-_]?(\d{2})")
+ROLLOVER = 6 * 3600   # Time of day jumping back this far means the next day
+
+
+# ==========================================
+# 1. PARALLEL PARSING (runs in worker processes)
+# ==========================================
+_PARSER = None
+
+
+def _init_worker(machine_type):
+    global _PARSER
+    from parsers.loader import load_parser
+    _PARSER = load_parser(machine_type)
+    if psutil:
+        # Stay out of the way of the RIP software and the live agent
+        try: psutil.Process().nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if os.name == "nt" else 10)
+        except Exception: pass
+
+
+def _line_tod(line):
+    """Seconds since midnight from the line prefix, or None."""
+    m = TOD_RE.match(line)
+    if not m: return None
+    h, mi, sec = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    ampm = (m.group(4) or "").upper()
+    if ampm: h = h % 12 + (12 if ampm == "PM" else 0)
+    if h > 23 or mi > 59 or sec > 59: return None
+    return h * 3600 + mi * 60 + sec
+
+
+def parse_range(job):
+    """Parses [start, end) of a file. Returns [(offset, time_of_day, event, payload), ...] for matched lines."""
+    path, start, end = job
+    out = []
+    last_tod = None
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            raw = f.readline()
+            if not raw: break
+            offset, pos = pos, pos + len(raw)
+            line = raw.decode("utf-8", errors="ignore").strip()
+            if not line: continue
+            tod = _line_tod(line)
+            if tod is not None: last_tod = tod
+            res = _PARSER.parse(line)
+            if not res: continue
+            for r in (res if isinstance(res, list) else [res]):
+                # raw_log is not uploaded; keep it out of the pickle back to the parent
+                payload = {k: v for k, v in (r.get("payload") or {}).items() if k != "raw_log"}
+                out.append((offset, last_tod, r.get("event"), payload))
+    return out
+
+
+def split_ranges(path, chunk_bytes=CHUNK_BYTES):
+    """Byte ranges aligned to line starts."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        pos = chunk_bytes
+        while pos < size:
+            f.seek(pos)
+            f.readline()
+            nxt = f.tell()
+            if nxt >= size: break
+            if nxt > bounds[-1]: bounds.append(nxt)
+            pos = nxt + chunk_bytes
+    bounds.append(size)
+    return [(path, a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def assign_timestamps(path, events):
+    """(offset, time_of_day, ...) → (offset, epoch_seconds, ...) for one file, in order."""
+    days, prev, rolled = [], None, 0
+    for _, tod, _, _ in events:
+        if tod is not None:
+            if prev is not None and tod < prev - ROLLOVER: rolled += 1
+            prev = tod
+        days.append(rolled)
+
+    m = NAME_DATE_RE.search(os.path.basename(path))
+    try:
+        base = time.strptime("".join(m.groups()), "%Y%m%d") if m else None
+    except ValueError:
+        base = None
+    if base is None:
+        # mtime is the date of the last line: step back over the midnights seen
+        last = time.localtime(os.path.getmtime(path))
+        base = time.localtime(time.mktime((last.tm_year, last.tm_mon, last.tm_mday - rolled, 0, 0, 0, 0, 0, -1)))
+
+    out, tod = [], None
+    for (offset, t, event, payload), day in zip(events, days):
+        tod = t if t is not None else tod
+        ts = None
+        if tod is not None:
+            ts = int(time.mktime((base.tm_year, base.tm_mon, base.tm_mday + day,
+                                  tod // 3600, tod % 3600 // 60, tod % 60, 0, 0, -1)))
+        out.append((offset, ts, event, payload))
+    return out
+
+
+# ==========================================
+# 2. SESSION RECONSTRUCTION
+# ==========================================
+class SessionBuilder:
+    """Feeds parsed events in order; closed sessions collect in .done."""
+
+    def __init__(self):
+        self.current = None
+        self.done = []
+
+    def _close(self, status, offset, ts):
+        s = self.current
+        if s:
+            s.update({"status": status, "end_offset": offset, "ended_at": ts or s["started_at"]})
+            self.done.append(s)
+        self.current = None
+
+    def feed(self, path, offset, ts, event, payload):
+        if event == "JOB_INFO" and payload.get("status") == "Started":
+            self._close("interrupted", offset, ts)
+            self.current = {"file": os.path.basename(path), "job_name": payload.get("job_name"),
+                            "start_offset": offset, "started_at": ts, "max_percentage": 0,
+                            "progress_updates": 0, "status_changes": []}
+        elif not self.current:
+            return
+        elif event == "JOB_PROGRESS":
+            self.current["progress_updates"] += 1
+            self.current["max_percentage"] = max(self.current["max_percentage"], payload.get("percentage") or 0)
+        elif event == "MACHINE_STATUS":
+            self.current["status_changes"].append(payload.get("status"))
+        elif event == "JOB_STATUS" and payload.get("status") == "Finished":
+            self._close("finished", offset, ts)
+        elif event == "POWER_STATUS" and payload.get("status") == "OFF":
+            self._close("interrupted", offset, ts)
+
+    def flush(self, offset, ts):
+        """End of file: a job still open is kept as incomplete."""
+        self._close("incomplete", offset, ts)
+
+    def take(self):
+        done, self.done = self.done, []
+        return done
+
+
+# ==========================================
+# 3. UPLOAD (gzip JSON batches, resumable)
+# ==========================================
+def _state_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}"
+
+
+def load_state(path):
+    try:
+        with open(path, "r") as f: return json.load(f)
+    except Exception: return {"files": {}}
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def upload_batch(session, url, headers, body):
+    backoff = Backoff(base=2, cap=300)
+    for attempt in range(UPLOAD_RETRIES + 1):
+        try:
+            r = session.post(url, data=body, headers=headers, timeout=120)
+            if r.status_code < 500 and r.status_code != 429:
+                r.raise_for_status()
+                return
+            err = f"HTTP {r.status_code}"
+        except requests.HTTPError:
+            raise
+        except requests.RequestException as e:
+            err = str(e)
+        if attempt == UPLOAD_RETRIES: raise RuntimeError(f"Upload failed: {err}")
+        delay = backoff.next()
+        log.warning(f"Upload failed ({err}), retrying in {delay:.0f}s")
+        time.sleep(delay)
+
+
+def find_log_files(conf, since=None):
+    live = conf.get("log_file_path")
+    if not live: return []
+    files = [p for p in glob.glob(os.path.join(os.path.dirname(live), "*.log*"))
+             if os.path.isfile(p) and os.path.abspath(p) != os.path.abspath(live)]
+    if since: files = [p for p in files if os.path.getmtime(p) >= since]
+    return sorted(files, key=os.path.getmtime)
+
+
+def run_backfill(conf, files, state_path, processes=None):
+    server = conf.get("server_url")
+    device_id = conf.get("device_id")
+    url = server.rstrip("/") + UPLOAD_PATH
+    headers = {"Authorization": f"Bearer {conf.get('jwt_token')}", "X-Device-Id": device_id,
+               "Content-Type": "application/json", "Content-Encoding": "gzip"}
+    state = load_state(state_path)
+    http = requests.Session()
+    processes = processes or max(1, (os.cpu_count() or 2) - 1)
+    total = 0
+
+    log.info(f"Backfill: {len(files)} file(s), {processes} parser process(es)")
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(conf.get("machine_type", "flex"),)) as pool:
+        for path in files:
+            key = _state_key(path)
+            done = state["files"].get(key, {})
+            if done.get("complete"):
+                log.info(f"Skipping {path} (already uploaded)")
+                continue
+
+            t0 = time.time()
+            events = []
+            for chunk in pool.imap(parse_range, split_ranges(path)):   # imap keeps file order
+                events.extend(chunk)
+            events = assign_timestamps(path, events)
+
+            # One builder per file: sessions and batch numbers depend on this file only
+            builder = SessionBuilder()
+            for offset, ts, event, payload in events:
+                builder.feed(path, offset, ts, event, payload)
+            builder.flush(os.path.getsize(path), events[-1][1] if events else None)
+            sessions = builder.take()
+            del events
+            log.info(f"Parsed {path}: {len(sessions)} session(s) in {time.time() - t0:.1f}s")
+
+            sent = done.get("batches", 0)
+            batches = [sessions[i:i + BATCH_SESSIONS] for i in range(0, len(sessions), BATCH_SESSIONS)]
+            for i, batch in enumerate(batches):
+                if i < sent: continue   # Uploaded in an earlier (interrupted) run
+                batch_id = hashlib.sha1(f"{device_id}|{key}|{i}".encode()).hexdigest()
+                body = gzip.compress(json.dumps({
+                    "device_id": device_id, "batch_id": batch_id, "file": os.path.basename(path),
+                    "batch": i, "batches": len(batches), "sessions": batch,
+                }).encode("utf-8"))
+                upload_batch(http, url, headers, body)
+                total += len(batch)
+                state["files"][key] = {"batches": i + 1}
+                save_state(state_path, state)
+                time.sleep(UPLOAD_PAUSE)
+
+            state["files"][key] = {"batches": len(batches), "complete": True, "sessions": len(sessions)}
+            save_state(state_path, state)
+
+    log.info(f"Backfill complete: {total} session(s) uploaded")
+    return total
+
+
+USAGE = "usage: agent.exe --backfill [FILE ...] [--since YYYY-MM-DD] [--processes N]"
+
+
+def parse_args(argv):
+    """[files...] [--since YYYY-MM-DD] [--processes N] following --backfill. Raises ValueError on bad input."""
+    args = argv[argv.index("--backfill") + 1:] if "--backfill" in argv else []
+    files, since, processes = [], None, None
+    it = iter(args)
+    for a in it:
+        if a in ("--since", "--processes"):
+            value = next(it, None)
+            if value is None: raise ValueError(f"{a} needs a value")
+            if a == "--since":
+                try: since = time.mktime(time.strptime(value, "%Y-%m-%d"))
+                except ValueError: raise ValueError(f"--since expects YYYY-MM-DD, got {value!r}")
+            else:
+                try: processes = int(value)
+                except ValueError: processes = 0
+                if processes < 1: raise ValueError(f"--processes expects a positive number, got {value!r}")
+        elif a.startswith("--"):
+            raise ValueError(f"unknown option {a}")
+        elif not os.path.isfile(a):
+            raise ValueError(f"no such file: {a}")
+        else:
+            files.append(a)
+    return files, since, processes
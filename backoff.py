@@ -0,0 +1,25 @@
+# backoff.py
+"""
+Jittered exponential backoff for reconnects.
+Each attempt waits a random time in [MIN_DELAY, min(cap, base * 2^n)]
+("full jitter"), so thousands of agents that lost the server in the same
+second spread their reconnects out instead of arriving together.
+"""
+import random
+
+MIN_DELAY = 0.5
+
+
+class Backoff:
+    def __init__(self, base=2.0, cap=120.0):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next(self):
+        ceiling = min(self.cap, self.base * (2 ** min(self.attempt, 16)))
+        self.attempt += 1
+        return random.uniform(MIN_DELAY, max(MIN_DELAY, ceiling))
+
+    def reset(self):
+        self.attempt = 0
@@ -0,0 +1,22 @@
+# bench/agent_runner.py
+"""
+Child process for the benchmark: runs the real run_agent_process()
+with the given config. The auto-updater is switched off so a benchmark
+run never downloads or launches an installer.
+Usage: python -m bench.agent_runner <config.json>
+"""
+import json
+import sys
+
+import agent
+
+
+def main():
+    with open(sys.argv[1], "r") as f:
+        conf = json.load(f)
+    agent.check_update_loop = lambda *args, **kwargs: None
+    agent.run_agent_process(conf)
+
+
+if __name__ == "__main__":
+    main()
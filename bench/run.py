@@ -0,0 +1,230 @@
+# bench/run.py
+"""
+PrintHex Agent - Pipeline Replay & Throughput Benchmark
+---------------------------------------------------------
+Runs the real agent (bench.agent_runner) against a local socket.io
+stand-in and feeds it one of:
+  flex   - a recorded (or synthetic) Flex RIP log, appended at --rate lines/sec
+  laser  - serial lines written into a pty pair at --rate lines/sec
+  konica - a local SNMP responder polled by the agent's SNMP monitor
+
+Reports: lines/sec, end-to-end latency percentiles, emits per job,
+bytes on the wire and the agent's CPU / RSS.
+
+Examples:
+  python -m bench.run flex --log D:\\rip\\printer.log --rate 500
+  python -m bench.run laser --rate 200 --lines 5000
+  python -m bench.run konica --duration 60 --json bench_output.txt
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from bench.server import BenchServer
+from bench.sources import FlexReplay, SerialFeed, SnmpResponder, load_lines, synthetic_flex_log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEVICE_ID = "bench-device"
+JWT_TOKEN = "bench-token"
+
+
+# ==========================================
+# HELPERS
+# ==========================================
+def percentile(values, pct):
+    if not values: return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def start_agent(workdir, conf):
+    """Starts the agent in its own process so its CPU/RSS can be measured in isolation."""
+    cfg_path = os.path.join(workdir, "bench_config.json")
+    with open(cfg_path, "w") as f:
+        json.dump(conf, f)
+    env = dict(os.environ, LOCALAPPDATA=workdir, PYTHONUNBUFFERED="1")
+    return subprocess.Popen([sys.executable, "-m", "bench.agent_runner", cfg_path], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class ProcSampler:
+    def __init__(self, pid):
+        self.proc = psutil.Process(pid) if psutil else None
+        self.rss = []
+        self.cpu_start = self._cpu()
+
+    def _cpu(self):
+        if not self.proc: return 0.0
+        t = self.proc.cpu_times()
+        return t.user + t.system
+
+    def sample(self):
+        if not self.proc: return
+        try: self.rss.append(self.proc.memory_info().rss)
+        except psutil.Error: pass
+
+    def cpu_seconds(self):
+        try: return self._cpu() - self.cpu_start
+        except Exception: return None
+
+
+def wait_until(predicate, timeout, sampler=None, step=0.1):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if sampler: sampler.sample()
+        if predicate(): return True
+        time.sleep(step)
+    return predicate()
+
+
+# ==========================================
+# BENCHMARK
+# ==========================================
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="printhex_bench_")
+    server = BenchServer(DEVICE_ID, JWT_TOKEN).start()
+    conf = {"device_id": DEVICE_ID, "jwt_token": JWT_TOKEN, "server_url": server.url, "machine_type": args.mode}
+
+    feeder = responder = None
+    if args.mode == "flex":
+        lines = load_lines(args.log) if args.log else synthetic_flex_log(jobs=args.jobs)
+        conf["log_file_path"] = os.path.join(workdir, "flex.log")
+        feeder = FlexReplay(conf["log_file_path"], lines[:args.lines] if args.lines else lines, args.rate)
+        raw_type, raw_key = "LOG_RAW", "line"
+    elif args.mode == "laser":
+        lines = [f"LASER,{i},POWER=80,SPEED=300,STATUS=CUTTING" for i in range(args.lines or 2000)]
+        feeder = SerialFeed(lines, args.rate)
+        conf.update({"serial_port": feeder.port, "baudrate": "115200"})
+        raw_type, raw_key = "serial", "raw"
+    else:
+        responder = SnmpResponder().start()
+        conf.update({"ip_address": "127.0.0.1", "snmp_port": responder.port})
+
+    child = start_agent(workdir, conf)
+    sampler = ProcSampler(child.pid)
+    report = {"mode": args.mode}
+    try:
+        if not server.authed.wait(timeout=30):
+            raise SystemExit("Agent did not authenticate with the local server within 30s")
+        time.sleep(1.5)  # Let the monitor threads open their sources
+
+        t0 = time.time()
+        if feeder:
+            feeder.start()
+            wait_until(feeder.done.is_set, timeout=args.duration or 3600, sampler=sampler)
+            expected = feeder.count
+            # Drain: wait for every line to reach the server (or give up)
+            wait_until(lambda: len(server.device_events(raw_type)) >= expected, timeout=args.drain, sampler=sampler)
+        else:
+            wait_until(lambda: False, timeout=args.duration or 30, sampler=sampler)
+        elapsed = time.time() - t0
+        report.update(collect(server, feeder, responder, elapsed, raw_type if feeder else None,
+                              raw_key if feeder else None))
+        report["agent_cpu_seconds"] = sampler.cpu_seconds()
+        report["agent_cpu_percent"] = (100.0 * report["agent_cpu_seconds"] / elapsed) if report["agent_cpu_seconds"] is not None else None
+        report["agent_rss_max_mb"] = (max(sampler.rss) / 1048576.0) if sampler.rss else None
+    finally:
+        child.terminate()
+        try: child.wait(timeout=5)
+        except subprocess.TimeoutExpired: child.kill()
+        if feeder: feeder.stop()
+        if responder: responder.stop()
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def collect(server, feeder, responder, elapsed, raw_type, raw_key):
+    records = server.snapshot()
+    events = [(ts, d) for ts, name, d, _ in records if name == "device_event"]
+    latencies = []
+
+    if feeder:
+        for ts, d in events:
+            if d.get("type") != raw_type: continue
+            sent = feeder.match((d.get("payload") or {}).get(raw_key))
+            if sent is not None: latencies.append(ts - sent)
+        delivered = len(latencies)
+    else:
+        polls = list(responder.polls)
+        dumps = [ts for ts, d in events if d.get("type") == "FULL_MACHINE_DATA"]
+        latencies = [ts - p for p, ts in zip(polls, dumps)]
+        delivered = len(dumps)
+
+    jobs = sum(1 for _, d in events if d.get("type") == "JOB_STATUS"
+               and (d.get("payload") or {}).get("status") == "Finished")
+    latencies_ms = [l * 1000.0 for l in latencies]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "items_sent": feeder.count if feeder else len(responder.polls),
+        "items_delivered": delivered,
+        "lines_per_sec": round(delivered / elapsed, 1) if elapsed else None,
+        "latency_ms": {p: percentile(latencies_ms, p) for p in (50, 90, 95, 99)},
+        "latency_ms_max": max(latencies_ms) if latencies_ms else None,
+        "device_events": len(events),
+        "jobs": jobs,
+        "emits_per_job": round(len(events) / jobs, 1) if jobs else None,
+        "wire_bytes": sum(r[3] for r in records),
+        "wire_messages": len(records),
+        "emits_by_name": _count_names(records),
+    }
+
+
+def _count_names(records):
+    out = {}
+    for _, name, d, _ in records:
+        key = f"device_event:{d.get('type')}" if name == "device_event" and isinstance(d, dict) else name
+        out[key] = out.get(key, 0) + 1
+    return out
+
+
+def print_report(r):
+    fmt = lambda v, unit="": "n/a" if v is None else (f"{v:.2f}{unit}" if isinstance(v, float) else f"{v}{unit}")
+    print(f"\n=== PrintHex Agent Benchmark ({r['mode']}) ===")
+    print(f"Elapsed:          {fmt(r['elapsed_s'], ' s')}")
+    print(f"Sent / delivered: {r['items_sent']} / {r['items_delivered']}")
+    print(f"Throughput:       {fmt(r['lines_per_sec'], ' lines/s')}")
+    lat = r["latency_ms"]
+    print(f"Latency (ms):     p50={fmt(lat[50])} p90={fmt(lat[90])} p95={fmt(lat[95])} "
+          f"p99={fmt(lat[99])} max={fmt(r['latency_ms_max'])}")
+    print(f"Emits per job:    {fmt(r['emits_per_job'])} ({r['device_events']} events / {r['jobs']} jobs)")
+    print(f"Bytes on wire:    {r['wire_bytes']} in {r['wire_messages']} messages")
+    print(f"Agent CPU:        {fmt(r['agent_cpu_seconds'], ' s')} ({fmt(r['agent_cpu_percent'], ' %')})")
+    print(f"Agent RSS max:    {fmt(r['agent_rss_max_mb'], ' MB')}")
+    for name, n in sorted(r["emits_by_name"].items()):
+        print(f"  {name:<32} {n}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="PrintHex agent pipeline benchmark")
+    ap.add_argument("mode", choices=["flex", "laser", "konica"])
+    ap.add_argument("--log", help="Recorded Flex log to replay (default: synthetic jobs)")
+    ap.add_argument("--jobs", type=int, default=20, help="Synthetic Flex jobs when --log is not given")
+    ap.add_argument("--rate", type=float, default=200.0, help="Lines per second to feed")
+    ap.add_argument("--lines", type=int, default=0, help="Limit number of lines fed (0 = all)")
+    ap.add_argument("--duration", type=float, default=0, help="Max feed time / SNMP run time in seconds")
+    ap.add_argument("--drain", type=float, default=15.0, help="Seconds to wait for the agent to catch up")
+    ap.add_argument("--json", help="Also write the report as JSON to this file")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bench/server.py
+"""
+Local socket.io stand-in for the PrintHex server.
+Implements just enough of the '/agent' namespace (auth -> auth_result
+with a session token, token resumption on connect) for the real agent
+to connect, and records everything that arrives.
+"""
+import json
+import logging
+import secrets
+import threading
+import time
+
+import socketio
+from werkzeug.serving import make_server
+
+
+class BenchServer:
+    def __init__(self, device_id, jwt_token, host="127.0.0.1", port=0, sessions=None):
+        self.device_id = device_id
+        self.jwt_token = jwt_token
+        self.sessions = {} if sessions is None else sessions   # session_token -> device_id
+        self.records = []           # (recv_ts, name, data, wire_bytes)
+        self.lock = threading.Lock()
+        self.authed = threading.Event()
+
+        self.sio = socketio.Server(async_mode="threading", namespaces=["/agent"])
+        self.app = socketio.WSGIApp(self.sio)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No per-request access log
+        self.httpd = make_server(host, port, self.app, threaded=True)
+        self.url = f"http://{host}:{self.httpd.server_port}"
+        self._thread = None
+
+        @self.sio.on("auth", namespace="/agent")
+        def on_auth(sid, data):
+            self._record("auth", data)
+            ok = (isinstance(data, dict) and data.get("device_id") == self.device_id
+                  and data.get("jwt") == self.jwt_token)
+            result = {"status": "error", "message": "Invalid Credentials"}
+            if ok:
+                token = secrets.token_urlsafe(16)
+                self.sessions[token] = self.device_id
+                result = {"status": "success", "session_token": token}
+            self.sio.emit("auth_result", result, to=sid, namespace="/agent")
+            if ok: self.authed.set()
+
+        @self.sio.on("connect", namespace="/agent")
+        def on_connect(sid, environ, auth=None):
+            # Session resumption: a known token in the CONNECT packet skips the auth round-trip
+            if isinstance(auth, dict) and auth.get("session_token"):
+                if self.sessions.get(auth["session_token"]) != auth.get("device_id"):
+                    return False
+                self._record("resume", auth)
+                self.authed.set()
+
+        @self.sio.on("*", namespace="/agent")
+        def on_any(event, sid, data=None):
+            self._record(event, data)
+
+    def _record(self, name, data):
+        now = time.time()
+        # Size of the socket.io message body as the agent put it on the wire
+        wire = len(json.dumps([name, data], separators=(",", ":")).encode("utf-8"))
+        with self.lock:
+            self.records.append((now, name, data, wire))
+
+    # --- Lifecycle ---
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    # --- Queries ---
+    def snapshot(self):
+        with self.lock:
+            return list(self.records)
+
+    def device_events(self, evt_type=None):
+        return [(ts, d) for ts, name, d, _ in self.snapshot()
+                if name == "device_event" and (evt_type is None or d.get("type") == evt_type)]
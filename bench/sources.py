@@ -0,0 +1,243 @@
+# bench/sources.py
+"""
+Input feeders for the benchmark harness.
+1. FlexReplay    - appends recorded Flex log lines to a temp file at a fixed rate.
+2. SerialFeed    - writes laser lines into one end of a pty pair (agent opens the other).
+3. SnmpResponder - tiny SNMP v2c responder for the OIDs SnmpParser polls.
+Every feeder records when each item went out so the harness can compute
+end-to-end latency against what the local server received.
+"""
+import collections
+import os
+import socket
+import threading
+import time
+
+
+# ==========================================
+# SAMPLE DATA
+# ==========================================
+def synthetic_flex_log(jobs=5, steps=20):
+    """Builds a Flex RIP log shaped like the real thing (power on, jobs, power off)."""
+    lines = ["ProceedKernelMessage kParam=Power_On;lParam=1", "==========Status_Change = Ready"]
+    for j in range(jobs):
+        lines.append(f"CreatFinished start Printing job=D:\\rip file\\bench\\job_{j}.prt")
+        lines.append("==========Status_Change = Busy")
+        for s in range(steps + 1):
+            lines.append(f"ProceedKernelMessage kParam=Percentage;lParam={s * 100 // steps}")
+            lines.append("ProceedKernelMessage kParam=Moving;lParam=0")
+        lines.append("ProceedKernelMessage kParam=Job_End;lParam=1")
+        lines.append("==========Status_Change = Ready")
+    lines.append("==========Status_Change = PowerOff")
+    return lines
+
+
+def load_lines(path):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return [l.strip() for l in f if l.strip()]
+
+
+def _paced(items, rate, stop_event):
+    """Yields items at `rate` per second without drifting."""
+    start = time.perf_counter()
+    for i, item in enumerate(items):
+        if stop_event.is_set(): return
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+        yield item
+
+
+class _Feeder:
+    def __init__(self, lines, rate):
+        self.lines = lines
+        self.rate = float(rate)
+        self.sent = collections.defaultdict(collections.deque)  # line -> write timestamps
+        self.count = 0
+        self.done = threading.Event()
+        self.stop_event = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def match(self, line):
+        """Pops the oldest write time for this line (FIFO handles repeated lines)."""
+        q = self.sent.get(line)
+        return q.popleft() if q else None
+
+    def _run(self):
+        try:
+            for line in _paced(self.lines, self.rate, self.stop_event):
+                self._write(line)
+                self.sent[line].append(time.time())
+                self.count += 1
+        finally:
+            self.done.set()
+
+
+# ==========================================
+# 1. FLEX LOG REPLAY
+# ==========================================
+class FlexReplay(_Feeder):
+    def __init__(self, path, lines, rate):
+        super().__init__(lines, rate)
+        self.path = path
+        open(path, "a").close()  # Agent only monitors a file that exists at startup
+        self._f = None
+
+    def _write(self, line):
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+        # One write per line so the agent never sees half a line
+        self._f.write(line + "\n")
+        self._f.flush()
+
+
+# ==========================================
+# 2. SERIAL (PTY PAIR)
+# ==========================================
+class SerialFeed(_Feeder):
+    def __init__(self, lines, rate):
+        super().__init__(lines, rate)
+        self.master, self.slave = os.openpty()
+        self.port = os.ttyname(self.slave)
+
+    def _write(self, line):
+        os.write(self.master, (line + "\n").encode("utf-8"))
+
+
+# ==========================================
+# 3. SNMP RESPONDER (v2c, GET / GETNEXT only)
+# ==========================================
+OID_STATUS = (1, 3, 6, 1, 2, 1, 25, 3, 2, 1, 5, 1)
+OID_COUNTER = (1, 3, 6, 1, 2, 1, 43, 10, 2, 1, 4, 1, 1)
+OID_TONER_MAX = (1, 3, 6, 1, 2, 1, 43, 11, 1, 1, 8, 1)
+OID_TONER_CUR = (1, 3, 6, 1, 2, 1, 43, 11, 1, 1, 9, 1)
+
+T_INT, T_OCTETS, T_NULL, T_OID, T_SEQ = 0x02, 0x04, 0x05, 0x06, 0x30
+T_COUNTER32, T_END_OF_MIB = 0x41, 0x82
+PDU_GET, PDU_GETNEXT, PDU_RESPONSE = 0xA0, 0xA1, 0xA2
+
+
+def _enc_len(n):
+    if n < 0x80: return bytes([n])
+    body = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(body)]) + body
+
+
+def _tlv(tag, body):
+    return bytes([tag]) + _enc_len(len(body)) + body
+
+
+def _enc_int(tag, n):
+    size = max(1, (n.bit_length() + 8) // 8)
+    return _tlv(tag, n.to_bytes(size, "big", signed=True))
+
+
+def _enc_oid(oid):
+    body = bytearray([oid[0] * 40 + oid[1]])
+    for arc in oid[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        body.extend(reversed(chunk))
+    return _tlv(T_OID, bytes(body))
+
+
+def _dec_tlv(buf, pos):
+    tag = buf[pos]
+    length = buf[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(buf[pos:pos + n], "big")
+        pos += n
+    return tag, buf[pos:pos + length], pos + length
+
+
+def _dec_seq(body):
+    items, pos = [], 0
+    while pos < len(body):
+        tag, val, pos = _dec_tlv(body, pos)
+        items.append((tag, val))
+    return items
+
+
+def _dec_oid(body):
+    oid = [body[0] // 40, body[0] % 40]
+    arc = 0
+    for b in body[1:]:
+        arc = (arc << 7) | (b & 0x7F)
+        if not b & 0x80:
+            oid.append(arc)
+            arc = 0
+    return tuple(oid)
+
+
+class SnmpResponder:
+    def __init__(self, host="127.0.0.1", port=0, status=3, pages_per_poll=1, toner=(80, 60, 40, 20)):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.5)
+        self.port = self.sock.getsockname()[1]
+        self.status = status
+        self.counter = 1000
+        self.pages_per_poll = pages_per_poll
+        self.toner = toner
+        self.polls = []             # timestamp of each poll cycle's first request
+        self.requests = 0
+        self.stop_event = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _mib(self):
+        mib = {OID_STATUS: (T_INT, self.status), OID_COUNTER: (T_COUNTER32, self.counter)}
+        for i, lvl in enumerate(self.toner, 1):
+            mib[OID_TONER_MAX + (i,)] = (T_INT, 100)
+            mib[OID_TONER_CUR + (i,)] = (T_INT, lvl)
+        return mib
+
+    def _lookup(self, pdu_type, oid):
+        mib = self._mib()
+        if pdu_type == PDU_GET:
+            return oid, mib.get(oid, (T_NULL, None))
+        for key in sorted(mib):
+            if key > oid: return key, mib[key]
+        return oid, (T_END_OF_MIB, None)
+
+    def _handle(self, data):
+        _, msg, _ = _dec_tlv(data, 0)
+        version, community, (pdu_type, pdu) = _dec_seq(msg)
+        req_id, _, _, (_, binds) = _dec_seq(pdu)
+        out = b""
+        for _, bind in _dec_seq(binds):
+            oid = _dec_oid(_dec_seq(bind)[0][1])
+            if oid == OID_STATUS:
+                self.polls.append(time.time())
+            elif oid == OID_COUNTER:
+                self.counter += self.pages_per_poll
+            oid, (tag, val) = self._lookup(pdu_type, oid)
+            value = _tlv(tag, b"") if val is None else _enc_int(tag, val)
+            out += _tlv(T_SEQ, _enc_oid(oid) + value)
+        body = _tlv(req_id[0], req_id[1]) + _enc_int(T_INT, 0) + _enc_int(T_INT, 0) + _tlv(T_SEQ, out)
+        return _tlv(T_SEQ, _tlv(*version) + _tlv(*community) + _tlv(PDU_RESPONSE, body))
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            self.requests += 1
+            try: self.sock.sendto(self._handle(data), addr)
+            except Exception: pass
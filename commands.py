@@ -0,0 +1,130 @@
+# commands.py
+"""
+Server → agent command channel.
+The server emits "command" on /agent:
+    {"id": "cmd-...", "command": "snmp_poll", "payload": {...}, "meta": {"timeout": 10}}
+Each command runs on a small worker pool; exactly one reply goes back,
+correlated by id, either the handler's result or a timeout/error:
+    device_event type "command_result" → {"command_id", "result": {"ok", ...}, "timestamp"}
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY
+
+COMMAND_WORKERS = 2
+COMMAND_TIMEOUT = 20      # seconds, server may ask for less via meta.timeout
+MAX_COMMAND_TIMEOUT = 120
+
+log = logging.getLogger("agent.commands")
+
+
+class CommandError(Exception):
+    """Raised by handlers for a clean {"ok": False, "error": ...} reply."""
+
+
+class CommandDispatcher:
+    def __init__(self, reply_fn, workers=COMMAND_WORKERS, timeout=COMMAND_TIMEOUT):
+        self.reply_fn = reply_fn
+        self.timeout = timeout
+        self.handlers = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cmd")
+        self.m_received = REGISTRY.counter("commands.received")
+        self.m_failed = REGISTRY.counter("commands.failed")
+        self.m_timeouts = REGISTRY.counter("commands.timeouts")
+        self.h_latency = REGISTRY.histogram("commands.seconds")
+
+    def register(self, name, fn):
+        """fn(payload) -> dict merged into the result (raise CommandError to fail)."""
+        self.handlers[name] = fn
+
+    def dispatch(self, msg):
+        if not isinstance(msg, dict): return
+        self.m_received.inc()
+        cid, name = msg.get("id"), msg.get("command")
+        payload = msg.get("payload") or {}
+        log.info(f"<< received command: {name} ({cid})")
+
+        handler = self.handlers.get(name)
+        if handler is None:
+            return self._send(cid, {"ok": False, "error": f"unknown command: {name}"})
+
+        try: timeout = min(float((msg.get("meta") or {}).get("timeout") or self.timeout), MAX_COMMAND_TIMEOUT)
+        except (TypeError, ValueError): timeout = self.timeout
+
+        started = time.perf_counter()
+        lock = threading.Lock()
+        state = {"done": False}
+
+        def finish(result):
+            with lock:
+                if state["done"]: return
+                state["done"] = True
+            timer.cancel()
+            self.h_latency.observe(time.perf_counter() - started)
+            if not result.get("ok"): self.m_failed.inc()
+            self._send(cid, result)
+
+        def on_timeout():
+            self.m_timeouts.inc()
+            finish({"ok": False, "error": f"timeout after {timeout:g}s"})
+
+        def on_done(future):
+            try:
+                result = {"ok": True}
+                result.update(future.result() or {})
+            except CommandError as e:
+                result = {"ok": False, "error": str(e)}
+            except Exception as e:
+                log.error(f"Command {name} crashed: {e}")
+                result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            finish(result)
+
+        timer = threading.Timer(timeout, on_timeout)
+        timer.daemon = True
+        timer.start()
+        try:
+            self.pool.submit(handler, payload).add_done_callback(on_done)
+        except RuntimeError as e:  # pool already shut down
+            finish({"ok": False, "error": str(e)})
+
+    def _send(self, cid, result):
+        result.setdefault("handled_at", int(time.time() * 1000))
+        try:
+            self.reply_fn(cid, result)
+            log.info(f">> sent command_result for {cid}")
+        except Exception as e:
+            log.error(f"command_result for {cid} failed: {e}")
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+# ==========================================
+# HELPERS used by the built-in commands
+# ==========================================
+def tail_file(path, lines=50, block=8192):
+    """Last `lines` lines of a text file without reading the whole file."""
+    if not path or not os.path.exists(path): return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        data = b""
+        while end > 0 and data.count(b"\n") <= lines:
+            step = min(block, end)
+            end -= step
+            f.seek(end)
+            data = f.read(step) + data
+    return data.decode("utf-8", errors="replace").splitlines()[-lines:]
+
+
+def bounded(payload, key, lo, hi):
+    """Reads payload[key] as a number within [lo, hi]; None if absent."""
+    if key not in payload or payload[key] is None: return None
+    try: value = float(payload[key])
+    except (TypeError, ValueError): raise CommandError(f"{key} must be a number")
+    if not lo <= value <= hi: raise CommandError(f"{key} must be between {lo} and {hi}")
+    return value
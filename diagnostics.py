@@ -0,0 +1,172 @@
+# diagnostics.py
+"""
+Local diagnostics endpoint for the background agent.
+- StatusBoard: live state the agent threads update (connection, monitors, errors).
+- DiagnosticsServer: read-only HTTP on 127.0.0.1, Bearer-token protected.
+  Port + token are written to diagnostics.json next to config.json, so only
+  the Windows user running the agent can read them.
+- read_status(): client used by the dashboard to poll the running agent.
+"""
+import collections
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+RATE_WINDOW = 60   # seconds used for per-monitor events/min
+MAX_ERRORS = 50
+
+
+class _RateMeter:
+    """Counts events in one-second buckets over the last RATE_WINDOW seconds."""
+    __slots__ = ("buckets", "total", "last_ts")
+
+    def __init__(self):
+        self.buckets = collections.deque(maxlen=RATE_WINDOW)  # [second, count]
+        self.total = 0
+        self.last_ts = None
+
+    def hit(self, n=1):
+        now = time.time()
+        sec = int(now)
+        if self.buckets and self.buckets[-1][0] == sec: self.buckets[-1][1] += n
+        else: self.buckets.append([sec, n])
+        self.total += n
+        self.last_ts = now
+
+    def per_minute(self):
+        cutoff = int(time.time()) - RATE_WINDOW
+        return sum(c for s, c in list(self.buckets) if s > cutoff) * 60.0 / RATE_WINDOW
+
+
+class _ErrorCapture(logging.Handler):
+    def __init__(self, board):
+        super().__init__(level=logging.WARNING)
+        self.board = board
+
+    def emit(self, record):
+        try: self.board.errors.append((record.created, record.levelname, record.getMessage()))
+        except Exception: pass
+
+
+class StatusBoard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = "starting"
+        self.connection_since = time.time()
+        self.monitors = {}
+        self.errors = collections.deque(maxlen=MAX_ERRORS)
+        self.last_emit = None
+
+    def set_connection(self, state):
+        with self.lock:
+            if state != self.connection:
+                self.connection = state
+                self.connection_since = time.time()
+
+    def touch(self, monitor, n=1):
+        """Called by a monitor each time it produced data."""
+        m = self.monitors.get(monitor)
+        if m is None:
+            with self.lock:
+                m = self.monitors.setdefault(monitor, _RateMeter())
+        m.hit(n)
+
+    def error_handler(self):
+        return _ErrorCapture(self)
+
+    def record_error(self, stage, message, level="ERROR"):
+        """Monitor failures that are only counted, not logged at WARNING. Repeats just refresh the time."""
+        text = f"{stage}: {message}"
+        with self.lock:
+            for old in [e for e in self.errors if e[2] == text]: self.errors.remove(old)
+            self.errors.append((time.time(), level, text))
+
+    def snapshot(self):
+        with self.lock:
+            monitors = dict(self.monitors)
+            conn, since = self.connection, self.connection_since
+        return {
+            "connection": {"state": conn, "since": since},
+            "monitors": {name: {"events_total": m.total, "events_per_min": round(m.per_minute(), 1),
+                                "last_event": m.last_ts} for name, m in monitors.items()},
+            "last_emit": self.last_emit,
+            "recent_errors": [{"ts": ts, "level": lvl, "message": msg} for ts, lvl, msg in list(self.errors)[-10:]],
+        }
+
+
+# ==========================================
+# HTTP ENDPOINT (read-only)
+# ==========================================
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "PrintHexDiag/1"
+
+    def _reply(self, code, body):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        expected = "Bearer " + self.server.token
+        if not hmac.compare_digest(self.headers.get("Authorization", ""), expected):
+            return self._reply(401, {"error": "unauthorized"})
+        if self.path.split("?")[0] != "/status":
+            return self._reply(404, {"error": "not found"})
+        try: self._reply(200, self.server.snapshot_fn())
+        except Exception as e: self._reply(500, {"error": str(e)})
+
+    def _read_only(self):
+        self._reply(405, {"error": "read-only endpoint"})
+
+    do_POST = do_PUT = do_DELETE = do_PATCH = _read_only
+
+    def log_message(self, fmt, *args):
+        pass  # Keep agent.log free of dashboard polling noise
+
+
+class DiagnosticsServer:
+    def __init__(self, snapshot_fn, info_path, port=0):
+        self.info_path = info_path
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", int(port)), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.token = secrets.token_urlsafe(24)
+        self.httpd.snapshot_fn = snapshot_fn
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        with open(self.info_path, "w") as f:
+            json.dump({"port": self.port, "token": self.httpd.token, "pid": os.getpid()}, f)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logging.info(f"Diagnostics endpoint on 127.0.0.1:{self.port}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()   # Release the port so a reload can bind it again
+        try: os.remove(self.info_path)
+        except OSError: pass
+
+
+def read_status(info_path, timeout=2):
+    """Returns the running agent's status dict, or None if it is not reachable."""
+    try:
+        with open(info_path, "r") as f:
+            info = json.load(f)
+        with requests.Session() as s:
+            s.trust_env = False  # Never route loopback through a shop proxy
+            r = s.get(f"http://127.0.0.1:{info['port']}/status",
+                      headers={"Authorization": f"Bearer {info['token']}"}, timeout=timeout)
+        if r.status_code == 200: return r.json()
+    except Exception:
+        pass
+    return None
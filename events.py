@@ -0,0 +1,60 @@
+# events.py
+"""
+Compact event object used from the parsers all the way to the socket.
+- __slots__ instead of the old result dict + send_event wrapper dict
+- encoded to JSON once (Event.encode) and the cached text is reused for
+  every emit attempt, including retries after a reconnect
+- still readable like the old parser dicts: ev["event"], ev.get("payload")
+
+socket.io would normally json.dumps the whole device_event again, so the
+client is created with json=wire_json, which splices the cached text
+into the packet instead of re-serializing it.
+"""
+import json
+import time
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+class Event:
+    __slots__ = ("type", "payload", "created_at", "queued_at", "wire")
+
+    def __init__(self, type, payload=None, created_at=None):
+        self.type = type
+        self.payload = payload if payload is not None else {}
+        self.created_at = created_at or int(time.time() * 1000)
+        self.queued_at = None
+        self.wire = None
+
+    def encode(self, device_id):
+        """device_event body as JSON text; built on the first call only."""
+        if self.wire is None:
+            self.wire = (f'{{"type":{_encode(self.type)},"device_id":{_encode(device_id)},'
+                         f'"payload":{_encode(self.payload)},"created_at":{self.created_at}}}')
+        return self.wire
+
+    # Old parser results were {"event": ..., "payload": ...}
+    def __getitem__(self, key):
+        if key == "event": return self.type
+        if key == "payload": return self.payload
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+    def __repr__(self):
+        return f"Event({self.type!r}, {self.payload!r})"
+
+
+class wire_json:
+    """json module for socketio.Client(json=...): Events inside a packet go out as their cached text."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if isinstance(obj, list) and any(isinstance(x, Event) for x in obj):
+            return "[" + ",".join(x.wire if isinstance(x, Event) else json.dumps(x, **kwargs)
+                                  for x in obj) + "]"
+        return json.dumps(obj, **kwargs)
+
+    loads = staticmethod(json.loads)
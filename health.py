@@ -0,0 +1,88 @@
+# health.py
+"""
+Windowed system-health sampler.
+Samples every few seconds into a ring buffer and reports min/avg/max/p95
+per window instead of one instantaneous reading:
+- system CPU % and RAM %
+- the agent process itself: CPU % (normalised to all cores), RSS, threads,
+  open handles (Windows) / file descriptors (elsewhere)
+- free space on the RIP spool drive
+"""
+import collections
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SAMPLE_INTERVAL = 5          # seconds
+HISTORY_SECONDS = 60 * 60    # ring buffer keeps the last hour
+
+
+def _stats(values):
+    if not values: return None
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return {"min": round(values[0], 1), "avg": round(sum(values) / len(values), 1),
+            "max": round(values[-1], 1), "p95": round(p95, 1)}
+
+
+class HealthSampler:
+    def __init__(self, spool_path=None, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.spool_path = spool_path
+        self.samples = collections.deque(maxlen=max(1, HISTORY_SECONDS // max(1, int(interval))))
+        self.lock = threading.Lock()
+        self.proc = psutil.Process() if psutil else None
+        self.cores = (psutil.cpu_count() or 1) if psutil else 1
+        if psutil:
+            # Prime the counters: the first cpu_percent() call always returns 0.0
+            psutil.cpu_percent(None)
+            self.proc.cpu_percent(None)
+
+    def sample(self):
+        if not psutil: return
+        rss = self.proc.memory_info().rss
+        s = (time.time(), psutil.cpu_percent(None), psutil.virtual_memory().percent,
+             self.proc.cpu_percent(None) / self.cores, rss / 1048576.0)
+        with self.lock:
+            self.samples.append(s)
+
+    def run(self, stop_event):
+        # First sample one interval after priming, so no reading covers a ~0 s span
+        while not stop_event.wait(self.interval):
+            try: self.sample()
+            except Exception: pass
+
+    def _handles(self):
+        try: return self.proc.num_handles() if os.name == "nt" else self.proc.num_fds()
+        except Exception: return None
+
+    def _disk_free_gb(self):
+        if not self.spool_path: return None
+        try: return round(psutil.disk_usage(self.spool_path).free / 1073741824.0, 2)
+        except Exception: return None
+
+    def report(self, window=60):
+        """Aggregates over the last `window` seconds, plus current process counters.
+        None until the first full-interval sample exists."""
+        if not psutil: return None
+        cutoff = time.time() - window
+        with self.lock:
+            recent = [s for s in self.samples if s[0] >= cutoff] or list(self.samples)[-1:]
+        if not recent: return None
+        cols = list(zip(*recent))
+        return {
+            "window": window,
+            "samples": len(recent),
+            "cpu": _stats(cols[1]),
+            "ram": _stats(cols[2]),
+            "agent_cpu": _stats(cols[3]),
+            "agent_rss_mb": _stats(cols[4]),
+            "agent_threads": self.proc.num_threads(),
+            "agent_handles": self._handles(),
+            "disk_free_gb": self._disk_free_gb(),
+        }
@@ -0,0 +1,122 @@
+# instance.py
+"""
+Single-instance guard + local control channel.
+- InstanceLock: OS file lock (msvcrt on Windows, fcntl elsewhere). The OS
+  drops it automatically if the process dies, so a crash never leaves a
+  stale lock behind.
+- ControlServer: the lock holder listens on 127.0.0.1 for one-line JSON
+  commands ({"token", "command", "args"}). Port + token live in a JSON file
+  next to config.json.
+- send_control(): a second launch forwards its request here instead of
+  starting a duplicate.
+"""
+import hmac
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+log = logging.getLogger(__name__)
+
+
+class InstanceLock:
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def acquire(self):
+        """Returns True if this process now owns the lock, False if another instance does."""
+        f = open(self.path, "a+")
+        try:
+            if msvcrt:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._f = f
+        return True
+
+    def release(self):
+        if not self._f: return
+        try:
+            if msvcrt:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        self._f.close()
+        self._f = None
+
+
+class ControlServer:
+    """Accepts commands from later launches. handler(command, args) -> dict reply."""
+
+    def __init__(self, info_path, handler):
+        self.info_path = info_path
+        self.handler = handler
+        self.token = secrets.token_urlsafe(24)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(4)
+        self.port = self.sock.getsockname()[1]
+        self._closed = False
+
+    def start(self):
+        with open(self.info_path, "w") as f:
+            json.dump({"port": self.port, "token": self.token, "pid": os.getpid()}, f)
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        try: self.sock.close()
+        except OSError: pass
+        try: os.remove(self.info_path)
+        except OSError: pass
+
+    def _serve(self):
+        while not self._closed:
+            try: conn, _ = self.sock.accept()
+            except OSError: break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            conn.settimeout(5)
+            try:
+                req = json.loads(conn.makefile("r", encoding="utf-8").readline() or "{}")
+                if not hmac.compare_digest(str(req.get("token", "")), self.token):
+                    reply = {"ok": False, "error": "unauthorized"}
+                else:
+                    log.info(f"Control command received: {req.get('command')}")
+                    reply = self.handler(req.get("command"), req.get("args") or {})
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            try: conn.sendall((json.dumps(reply) + "\n").encode("utf-8"))
+            except OSError: pass
+
+
+def send_control(info_path, command, args=None, timeout=3):
+    """Sends a command to the running instance. Returns its reply, or None if nothing is listening."""
+    try:
+        with open(info_path, "r") as f:
+            info = json.load(f)
+        with socket.create_connection(("127.0.0.1", info["port"]), timeout=timeout) as s:
+            msg = {"token": info["token"], "command": command, "args": args or {}}
+            s.sendall((json.dumps(msg) + "\n").encode("utf-8"))
+            return json.loads(s.makefile("r", encoding="utf-8").readline())
+    except Exception:
+        return None
@@ -0,0 +1,141 @@
+# metrics.py
+"""
+Lightweight in-process metrics for the agent.
+Counters, gauges and fixed-bucket histograms kept in one registry.
+Hot-path cost is one uncontended lock and an add (plus a bisect for
+histograms); callers should grab the metric object once and reuse it.
+The registry is shipped periodically inside the TELEMETRY frame (telemetry.py).
+"""
+import bisect
+import threading
+import time
+
+# Seconds. Covers per-line parse time (~µs) up to slow SNMP/emit calls (~s).
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def bucket_percentile(bounds, counts, pct, mx):
+    """Upper bound of the bucket holding the pct-th observation, never above the observed max."""
+    count = sum(counts)
+    if not count: return None
+    rank = count * pct / 100.0
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= rank and c:
+            return min(bounds[i], mx) if i < len(bounds) else mx
+    return mx
+
+
+class Counter:
+    __slots__ = ("name", "value", "_lock")
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    __slots__ = ("name", "value")
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """Fixed upper-bound buckets (last bucket is +Inf)."""
+    __slots__ = ("name", "bounds", "counts", "count", "total", "max", "_lock")
+
+    def __init__(self, name, bounds=LATENCY_BUCKETS):
+        self.name = name
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max: self.max = value
+
+    def percentile(self, pct):
+        with self._lock:
+            counts, mx = list(self.counts), self.max
+        return bucket_percentile(self.bounds, counts, pct, mx)
+
+    def snapshot(self):
+        with self._lock:
+            counts, count, total, mx = list(self.counts), self.count, self.total, self.max
+        snap = {
+            "count": count,
+            "sum": round(total, 6),
+            "max": round(mx, 6),
+            "p50": bucket_percentile(self.bounds, counts, 50, mx),
+            "p95": bucket_percentile(self.bounds, counts, 95, mx),
+            "buckets": counts,
+        }
+        if self.bounds != LATENCY_BUCKETS: snap["le"] = self.bounds
+        return snap
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _get(self, cls, name, *args):
+        m = self._metrics.get(name)
+        if m is None:
+            with self._lock:
+                m = self._metrics.get(name)
+                if m is None:
+                    m = self._metrics[name] = cls(name, *args)
+        return m
+
+    def counter(self, name):
+        return self._get(Counter, name)
+
+    def gauge(self, name):
+        return self._get(Gauge, name)
+
+    def histogram(self, name, bounds=LATENCY_BUCKETS):
+        return self._get(Histogram, name, bounds)
+
+    def value(self, name, default=0):
+        m = self._metrics.get(name)
+        return default if m is None or isinstance(m, Histogram) else m.value
+
+    def snapshot(self):
+        out = {"uptime": int(time.time() - self.started_at), "counters": {}, "gauges": {}, "histograms": {}}
+        for name, m in list(self._metrics.items()):
+            if isinstance(m, Counter): out["counters"][name] = m.snapshot()
+            elif isinstance(m, Gauge): out["gauges"][name] = m.snapshot()
+            else: out["histograms"][name] = m.snapshot()
+        out["bucket_bounds"] = LATENCY_BUCKETS
+        return out
+
+
+# Process-wide registry
+REGISTRY = Registry()
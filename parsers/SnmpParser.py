@@ -2,13 +2,16 @@
 import time
 from pysnmp.hlapi import *
 
+from events import Event
+
 class SnmpParser:
     """
     Konica Minolta / Universal SNMP Parser
     Retrieves: Status, Counters, Toner Levels (C,M,Y,K), and Device Info.
     """
-    def __init__(self, ip_address, community='public'):
+    def __init__(self, ip_address, community='public', port=161):
         self.ip = ip_address
+        self.port = port
         self.community = community
         self.last_counter = 0
         self.last_status = "UNKNOWN"
@@ -18,7 +21,7 @@ class SnmpParser:
         try:
             iterator = getCmd(SnmpEngine(),
                               CommunityData(self.community, mpModel=1), # SNMP v2c
-                              UdpTransportTarget((self.ip, 161), timeout=2, retries=1),
+                              UdpTransportTarget((self.ip, self.port), timeout=2, retries=1),
                               ContextData(),
                               ObjectType(ObjectIdentity(oid)))
             errorIndication, errorStatus, errorIndex, varBinds = next(iterator)
@@ -34,7 +37,7 @@ class SnmpParser:
         try:
             iterator = nextCmd(SnmpEngine(),
                                CommunityData(self.community, mpModel=1),
-                               UdpTransportTarget((self.ip, 161), timeout=2, retries=1),
+                               UdpTransportTarget((self.ip, self.port), timeout=2, retries=1),
                                ContextData(),
                                ObjectType(ObjectIdentity(root_oid)),
                                lexicographicMode=False)
@@ -103,31 +106,22 @@ class SnmpParser:
         events = []
         
         # A. Send Full Dump (Server decides what to keep)
-        events.append(data_packet)
+        events.append(Event(data_packet['event'], data_packet['payload']))
 
         # B. If Status Changed -> Send Specific Event for UI update
         if current_status != self.last_status:
-            events.append({
-                "event": "MACHINE_STATUS",
-                "payload": { "status": current_status }
-            })
+            events.append(Event("MACHINE_STATUS", { "status": current_status }))
             self.last_status = current_status
 
         # C. If Supplies Found -> Send Supply Event
         if data_packet['payload'].get('supplies'):
-             events.append({
-                "event": "SUPPLY_LEVELS",
-                "payload": data_packet['payload']['supplies']
-            })
+             events.append(Event("SUPPLY_LEVELS", data_packet['payload']['supplies']))
 
         # D. If Job Finished -> Send Job Event
         if data_packet['payload'].get('job_finished'):
-             events.append({
-                "event": "JOB_STATUS",
-                "payload": { 
-                    "status": "Finished", 
-                    "pages_printed": data_packet['payload']['pages_printed'] 
-                }
-            })
+             events.append(Event("JOB_STATUS", {
+                "status": "Finished",
+                "pages_printed": data_packet['payload']['pages_printed']
+            }))
 
         return events # Return list of events
\ No newline at end of file
@@ -1,5 +1,7 @@
 import os
 
+from events import Event
+
 class FlexParser:
     """
     Flex Printer Log Parser (Complete Version)
@@ -19,33 +21,24 @@ class FlexParser:
         if "kParam=Power_On" in line:
             try:
                 if "lParam=1" in line:
-                    return {
-                        "event": "POWER_STATUS",
-                        "payload": {
-                            "status": "ON",
-                            "raw_log": line
-                        }
-                    }
+                    return Event("POWER_STATUS", {
+                        "status": "ON",
+                        "raw_log": line
+                    })
                 elif "lParam=0" in line:
-                    return {
-                        "event": "POWER_STATUS",
-                        "payload": {
-                            "status": "OFF",
-                            "raw_log": line
-                        }
-                    }
+                    return Event("POWER_STATUS", {
+                        "status": "OFF",
+                        "raw_log": line
+                    })
             except Exception:
                 pass
 
         # Log: ==========Status_Change = PowerOff
         if "Status_Change = PowerOff" in line:
-            return {
-                "event": "POWER_STATUS",
-                "payload": {
-                    "status": "OFF",
-                    "raw_log": line
-                }
-            }
+            return Event("POWER_STATUS", {
+                "status": "OFF",
+                "raw_log": line
+            })
 
         # ==========================================
         # 2. SMART STATUS CHANGE (Ready, Busy, Moving, etc.)
@@ -62,13 +55,10 @@ class FlexParser:
                 if status_text.lower() == "poweroff":
                     return None
 
-                return {
-                    "event": "MACHINE_STATUS",
-                    "payload": {
-                        "status": status_text,
-                        "raw_log": line
-                    }
-                }
+                return Event("MACHINE_STATUS", {
+                    "status": status_text,
+                    "raw_log": line
+                })
             except Exception:
                 pass
 
@@ -84,13 +74,10 @@ class FlexParser:
                     percent_val = parts[1].split(';')[0].strip()
                     percentage = int(percent_val)
                     
-                    return {
-                        "event": "JOB_PROGRESS",
-                        "payload": {
-                            "percentage": percentage,
-                            "raw_log": line
-                        }
-                    }
+                    return Event("JOB_PROGRESS", {
+                        "percentage": percentage,
+                        "raw_log": line
+                    })
             except Exception:
                 pass
 
@@ -101,14 +88,11 @@ class FlexParser:
         if "start Printing job=" in line:
             try:
                 job_path = line.split("start Printing job=")[1].strip()
-                return {
-                    "event": "JOB_INFO",
-                    "payload": {
-                        "job_name": os.path.basename(job_path),
-                        "status": "Started",
-                        "raw_log": line
-                    }
-                }
+                return Event("JOB_INFO", {
+                    "job_name": os.path.basename(job_path),
+                    "status": "Started",
+                    "raw_log": line
+                })
             except Exception as e:
                 pass
 
@@ -117,13 +101,10 @@ class FlexParser:
         # ==========================================
         # Log: ProceedKernelMessage kParam=Job_End;lParam=1
         if "Job_End" in line or "Finsh_Printing" in line:
-            return {
-                "event": "JOB_STATUS",
-                "payload": {
-                    "status": "Finished",
-                    "raw_log": line
-                }
-            }
+            return Event("JOB_STATUS", {
+                "status": "Finished",
+                "raw_log": line
+            })
 
         # -------------------------
         # No Match
@@ -0,0 +1,60 @@
+# telemetry.py
+"""
+Unified telemetry frame: device status + system health + agent metrics
+in one TELEMETRY event instead of separate device_status, SYSTEM_HEALTH
+and AGENT_METRICS emits. Counters and histograms are both per frame
+(deltas since the previous frame); histograms go out as
+[count, p50, p95, max], so a frame stays small.
+"""
+import time
+
+from metrics import bucket_percentile
+
+FRAME_INTERVAL = 60     # Seconds between full frames (sooner if device status changes)
+HEARTBEAT_QUIET = 10    # Explicit heartbeat only after this long without any emit
+
+
+class TelemetryFrame:
+    def __init__(self, registry):
+        self.registry = registry
+        self._prev = {}
+        self._prev_buckets = {}
+        self.last_status = None
+
+    def status_changed(self, status):
+        return status != self.last_status
+
+    def build(self, status, health=None):
+        snap = self.registry.snapshot()
+        counters = {}
+        for name, value in snap["counters"].items():
+            delta = value - self._prev.get(name, 0)
+            if delta: counters[name] = delta
+        self._prev = snap["counters"]
+        self.last_status = status
+
+        latency = {}
+        for name, h in snap["histograms"].items():
+            prev = self._prev_buckets.get(name) or [0] * len(h["buckets"])
+            delta = [c - p for c, p in zip(h["buckets"], prev)]
+            self._prev_buckets[name] = h["buckets"]
+            if not any(delta): continue
+            bounds = h.get("le", snap["bucket_bounds"])
+            # Frame max: top non-empty bucket, capped by the lifetime max
+            top = max(i for i, c in enumerate(delta) if c)
+            mx = min(bounds[top], h["max"]) if top < len(bounds) else h["max"]
+            latency[name] = [sum(delta), bucket_percentile(bounds, delta, 50, mx),
+                             bucket_percentile(bounds, delta, 95, mx), mx]
+
+        frame = {
+            "ts": int(time.time() * 1000),
+            "status": status,
+            "agent": {
+                "uptime": snap["uptime"],
+                "counters": counters,
+                "gauges": snap["gauges"],
+                "latency": latency,
+            },
+        }
+        if health: frame["health"] = health
+        return frame
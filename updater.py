@@ -1,68 +1,256 @@
 import os
 import time
+import random
+import hashlib
+import logging
+import tempfile
+import threading
 import requests
 import subprocess
-import sys
+
+from agent_logging import shutdown_logging
 
 UPDATE_URL = "https://python.printhex.in/api/agent/latest"
 
-# ✅ Update Check Interval (Fast)
-CHECK_INTERVAL = 300   # 5 min (change to 60 for 1 min)
+# ✅ Update Check Interval (manifest poll is a cheap 304 when nothing changed)
+CHECK_INTERVAL = 300   # 5 min
+MAX_BACKOFF = 3600     # Back off up to 1 hour while the server / link is failing
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_RETRIES = 5
 
-def check_update_loop():
-    while True:
+# ✅ Don't disturb live printing
+PREFETCH_MAX_BPS = 256 * 1024    # Background download cap so telemetry keeps the link
+IDLE_WINDOW = 10 * 60            # Install only after 10 min without job/serial traffic
+MAX_DEFER = 24 * 60 * 60         # ...but never postpone an update for more than a day
+HANDOVER_TIMEOUT = 30            # Seconds the agent gets to flush + checkpoint
+
+log = logging.getLogger("updater")
+
+
+class UpdateError(Exception):
+    pass
+
+
+# ----------------------------
+# ✅ Coordination with the running monitors
+# ----------------------------
+class UpdateCoordinator:
+    """
+    Monitors call activity() whenever a job is printing (JOB_PROGRESS,
+    serial traffic...). The updater waits until idle_for() reaches
+    IDLE_WINDOW, then handover() runs the callbacks the agent registered
+    (flush outbound queue, checkpoint log position) before the installer starts.
+    If the installer cannot be launched, abort() undoes the handover.
+    """
+    def __init__(self):
+        self.last_activity = time.time()   # A fresh process must see a full idle window first
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def activity(self):
+        self.last_activity = time.time()
+
+    def idle_for(self):
+        return time.time() - self.last_activity
+
+    def register(self, fn, abort=None):
+        """fn(timeout) is called on handover, abort() if the install then fails. Returns an unregister function."""
+        entry = (fn, abort)
+        with self._lock: self._callbacks.append(entry)
+
+        def unregister():
+            with self._lock:
+                if entry in self._callbacks: self._callbacks.remove(entry)
+        return unregister
+
+    def handover(self, timeout=HANDOVER_TIMEOUT):
+        """False if any callback vetoed (returned False) or failed; the caller then aborts."""
+        with self._lock: callbacks = list(self._callbacks)
+        ok = True
+        for fn, _ in callbacks:
+            try:
+                if fn(timeout) is False: ok = False
+            except Exception as e:
+                log.error(f"Handover step failed: {e}")
+                ok = False
+        return ok
+
+    def abort(self):
+        with self._lock: callbacks = list(self._callbacks)
+        for _, fn in callbacks:
+            if fn is None: continue
+            try: fn()
+            except Exception as e: log.error(f"Handover abort step failed: {e}")
+
+
+def wait_for_idle(coordinator, idle_seconds=IDLE_WINDOW, max_wait=MAX_DEFER, poll=30):
+    """Blocks until no printing activity for idle_seconds (or max_wait passed)."""
+    if coordinator is None: return
+    start = time.time()
+    if coordinator.idle_for() < idle_seconds:
+        log.info("⏸ Machine busy, update deferred until idle")
+    while coordinator.idle_for() < idle_seconds:
+        if time.time() - start > max_wait:
+            log.warning("Machine never idle, installing update anyway")
+            return
+        time.sleep(poll)
+
+
+# ----------------------------
+# ✅ Manifest (conditional GET)
+# ----------------------------
+def fetch_manifest(session, etag=None, url=UPDATE_URL):
+    """Returns (manifest, etag). manifest is None when the server answered 304 Not Modified."""
+    headers = {"If-None-Match": etag} if etag else {}
+    r = session.get(url, headers=headers, timeout=10)
+    if r.status_code == 304:
+        return None, etag
+    r.raise_for_status()
+    return r.json(), r.headers.get("ETag")
+
+
+def next_delay(failures):
+    """Normal interval when healthy, jittered exponential backoff after failures."""
+    if not failures: return CHECK_INTERVAL
+    delay = min(MAX_BACKOFF, CHECK_INTERVAL * (2 ** min(failures, 10)))
+    return random.uniform(delay / 2, delay)
+
+
+# ----------------------------
+# ✅ Streaming, resumable download
+# ----------------------------
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def download_installer(url, dest, sha256, session=None, chunk_size=CHUNK_SIZE, retries=DOWNLOAD_RETRIES,
+                       max_bps=None):
+    """
+    Streams url into dest + ".part" in chunks, resuming with an HTTP Range
+    request after a dropped connection, then checks the SHA-256 from the
+    manifest before renaming to dest. Raises UpdateError on mismatch.
+    max_bps caps the download rate (bytes/sec).
+    """
+    expected = (sha256 or "").lower()
+    if not expected:
+        raise UpdateError("Manifest has no sha256, refusing to install unverified installer")
+    if os.path.exists(dest) and sha256_file(dest) == expected:
+        return dest
+
+    session = session or requests.Session()
+    part = dest + ".part"
+    for attempt in range(retries + 1):
         try:
-            # ✅ Current running exe
-            current_exe = sys.executable
+            _download_to(session, url, part, chunk_size, max_bps)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries: raise
+            log.warning(f"Download interrupted ({e}), resuming...")
+            time.sleep(min(60, 2 ** attempt))
+
+    actual = sha256_file(part)
+    if actual != expected:
+        os.remove(part)
+        raise UpdateError(f"Installer checksum mismatch (expected {expected}, got {actual})")
+    os.replace(part, dest)
+    return dest
+
+
+def _download_to(session, url, part, chunk_size, max_bps=None):
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=30) as r:
+        if r.status_code == 416:
+            return  # .part already holds the whole file; checksum decides
+        r.raise_for_status()
+        # 200 means the server ignored Range: start over
+        mode = "ab" if r.status_code == 206 else "wb"
+        started, received = time.monotonic(), 0
+        with open(part, mode) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if not chunk: continue
+                f.write(chunk)
+                received += len(chunk)
+                if max_bps:
+                    ahead = received / max_bps - (time.monotonic() - started)
+                    if ahead > 0: time.sleep(ahead)
+
+
+def run_installer(installer_file):
+    log.info("⚙ Running silent upgrade...")
+    subprocess.Popen([
+        installer_file,
+        "/VERYSILENT",
+        "/SUPPRESSMSGBOXES",
+        "/NORESTART"
+    ])
+
 
+def check_update_loop(coordinator=None):
+    session = requests.Session()
+    etag = None
+    manifest = None
+    failures = 0
+
+    while True:
+        try:
             # ✅ Current version
             from version import VERSION
 
-            # ✅ Server response
-            r = requests.get(UPDATE_URL, timeout=5).json()
+            # ✅ Server response (304 → keep the manifest we already have)
+            fresh, etag = fetch_manifest(session, etag)
+            if fresh is not None: manifest = fresh
 
-            latest = r.get("version")
-
-            # ✅ Now server should return installer URL
-            installer_url = r.get("installer_url")
+            latest = (manifest or {}).get("version")
+            installer_url = (manifest or {}).get("installer_url")
 
             # ----------------------------
             # ✅ Update Available
             # ----------------------------
-            if latest and latest != VERSION:
-                print("✅ Update found:", latest)
+            if latest and installer_url and latest != VERSION:
+                log.info(f"✅ Update found: {latest}")
 
                 # ✅ Download installer into TEMP
                 installer_file = os.path.join(
-                    os.getenv("TEMP"),
+                    os.getenv("TEMP") or tempfile.gettempdir(),
                     f"PrintHexAgentSetup_{latest}.exe"
                 )
 
-                print("⬇ Downloading installer...")
-
-                data = requests.get(installer_url, timeout=60).content
-                with open(installer_file, "wb") as f:
-                    f.write(data)
+                log.info("⬇ Pre-fetching installer in background...")
+                download_installer(installer_url, installer_file, manifest.get("sha256"), session=session,
+                                   max_bps=PREFETCH_MAX_BPS)
+                log.info(f"✅ Installer downloaded and verified: {installer_file}")
 
-                print("✅ Installer downloaded:", installer_file)
+                # ----------------------------
+                # ✅ Wait for idle, let the agent flush + checkpoint
+                # ----------------------------
+                wait_for_idle(coordinator)
+                if coordinator and not coordinator.handover(HANDOVER_TIMEOUT):
+                    coordinator.abort()
+                    raise UpdateError("Handover incomplete, update postponed")
 
                 # ----------------------------
                 # ✅ Run Silent Installer Update
                 # ----------------------------
-                print("⚙ Running silent upgrade...")
-
-                subprocess.Popen([
-                    installer_file,
-                    "/VERYSILENT",
-                    "/SUPPRESSMSGBOXES",
-                    "/NORESTART"
-                ])
+                try:
+                    run_installer(installer_file)
+                except Exception as e:
+                    # Agent keeps running: undo checkpoint / machine_state, retry next cycle
+                    if coordinator: coordinator.abort()
+                    raise UpdateError(f"Installer launch failed: {e}")
 
                 # ✅ Exit current agent (installer will replace files)
+                shutdown_logging()
                 os._exit(0)
 
+            failures = 0
+
         except Exception as e:
-            print("Updater error:", e)
+            failures += 1
+            log.error(f"Updater error: {e}")
 
-        # ✅ Check every 1 minutes
-        time.sleep(60)
+        time.sleep(next_delay(failures))